@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+# throttled stand-in for shred -v -n 0 -z, run by fixtures/bin/shred when FAKE_THROTTLE is set
+# the erases behind one controller share its bandwidth, and every erase past the first costs a share of it, the way
+# command overhead and seeks do on a real link; FAKE_THROTTLE is a directory holding
+#   groups.json  {"image path": "controller", ...}
+#   limits.json  {"drive_rate": bytes/s, "bandwidth": bytes/s, "contention": share lost per extra erase}
+# each running erase keeps a file named after its pid in a directory per controller, so the others can count it
+import json,os,sys,time
+
+#erases still running behind a controller, leaving out the files of any that were killed
+def streams(directory):
+    count=0
+    for name in os.listdir(directory):
+        try:
+            os.kill(int(name),0)
+            count+=1
+        except (OSError,ValueError):
+            pass
+    return max(count,1)
+
+dev=sys.argv[-1]
+root=os.environ['FAKE_THROTTLE']
+with open(os.path.join(root,'groups.json')) as f:
+    group=json.load(f).get(dev,'unknown')
+with open(os.path.join(root,'limits.json')) as f:
+    limits=json.load(f)
+directory=os.path.join(root,group.replace('/','_'))
+os.makedirs(directory,exist_ok=True)
+me=os.path.join(directory,str(os.getpid()))
+open(me,'w').close()
+try:
+    size=os.stat(dev).st_size
+    #the image reads back as zeros straight away; only the time a real drive would take is simulated
+    os.truncate(dev,0)
+    os.truncate(dev,size)
+    done=0
+    while done < size:
+        count=streams(directory)
+        rate=min(limits['drive_rate'],limits['bandwidth']/(1+limits['contention']*(count-1))/count)
+        step=min(rate/4,size-done)
+        time.sleep(step/rate)
+        done+=step
+        print(f'shred: {dev}: pass 1/1 (000000)...{done/1024:.0f}KiB/{size/1024:.0f}KiB {done*100//size:.0f}%',file=sys.stderr,flush=True)
+finally:
+    os.remove(me)
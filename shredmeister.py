@@ -5,7 +5,7 @@
 # Please report bugs/crashes/edge conditions. Some drives, USB enclosures or card readers may not work properly.
 # 
 # Required packages: (most will be there by default)
-# jq smartmontools findutils util-linux-libs grep python-pysimplegui python-humanize
+# jq smartmontools findutils util-linux-libs util-linux grep python-pysimplegui python-humanize openssl
 # 
 # Required packages:
 # pacman -Syu jq smartmontools grep python-humanize python-paramiko
@@ -16,8 +16,6 @@
 #
 # todo:
 # more debugging, look for edge cases
-# add ability to modify smart attributes and how they are displayed (perhaps external json file)
-# add ability to export or load list of processed drives
 
 import PySimpleGUI as sg
 import os
@@ -27,74 +25,451 @@ import signal
 import humanize
 import time
 import threading
+import concurrent.futures
 import argparse
 import re
+import shlex
+import tempfile
+import statistics
+import mmap
+import stat
+import hashlib
+import collections
+import datetime
+import io
+import random
+import selectors
+import socket
+import queue
+import sys
+import functools
+import cProfile
+import pstats
+import http.server
+import fcntl
+import array
+import bisect
+import struct
+import zlib
 
-smart_data_dict= dict()
 all_drives=dict()
-subproc_list = list()
-timer_list_short = list()
-timer_list_extended = list()
 
 QUIT=False
 
-#returns dictionary of drives, format is "{serial}"->"{path}"
-def get_serials_from_drive_paths(drive_paths):
-    drives=dict()
-    for i in drive_paths:
-        #faster method but doesn't work with all drive types
+#erase method for drives that aren't NVMe: 'shred', the in-process 'native' zero fill, or 'random' for a seeded random
+#pattern that verification can regenerate; --erase-engine
+erase_engine='shred'
+#seed of the random pattern, to reproduce one; a new one is picked for every drive if None; --pattern-seed
+pattern_seed=None
+#size of each write made by the native zero fill
+erase_block_size=16*1024*1024
+#SATA and SAS SSDs whose queue accepts discards are discarded instead of overwritten, then a sample is read back to check
+#they return zeros; 'off' overwrites them like any other drive; --ssd-discard
+ssd_discard='auto'
+#discards are issued this many bytes at a time, each reported as progress
+discard_step=1024**3
+#random ranges read back after discarding an SSD; one that returns anything but zeros is overwritten instead
+discard_check_samples=64
+#drives erasing slower than this fraction of the median speed of all running erases are flagged; --slow-fraction
+slow_fraction=0.5
+#progress of running erases, "{serial}"->JobProgress
+erase_progress=dict()
+#erases sharing a controller, expander or USB hub start with this many running at once; --group-limit caps how far it adapts
+group_start_limit=2
+group_max_limit=8
+#seconds between adjustments of a group's limit; long enough for the current rate to settle after a change
+group_adapt_interval=60
+#a higher limit is kept only if the group's total speed improves by at least this fraction
+group_min_gain=0.1
+#simulated topology from --topology, "{path}"->"{sysfs path}"; empty to read the real one
+simulated_topology=dict()
+#directory of *.img files that stand in for block devices, from --devices; None to look for real ones
+simulated_devices=None
+#size of each read made by verification
+verify_block_size=16*1024*1024
+#verification records at most this many separate non-zero regions per drive
+verify_max_regions=1000
+#sampled verification reads this many randomly placed ranges of verify_sample_size bytes, plus the head and tail of the drive
+verify_samples=1000
+verify_sample_size=1024*1024
+#sampled verification reports its confidence of catching this fraction of the drive being non-zero
+verify_detect_fraction=0.01
+#default verification mode, 'full' or 'sampled'; --verify-mode
+verify_mode='full'
+#erase progress is saved to the journal this often, and the native engine flushes the drive's cache this often so the saved offset is on disk
+journal_checkpoint_interval=30
+#an erase whose checkpoint was not flushed to the drive (shred, dd) resumes this far before it, to cover what the page cache
+#or the drive's write cache may still have held when the host went down
+erase_resume_margin=8*1024**3
+#an interrupted erase whose last checkpoint is older than this starts over; the drive may have been written elsewhere since
+erase_resume_max_age=24*3600
+#progress of running verifications
+verify_progress=dict()
+
+#timings and counters for stations left running for days; exported in Prometheus text format on --metrics-port and
+#summarised in a log line every --metrics-interval seconds
+#observe() adds a sample to a summary (count, sum and max), increment() adds to a counter, both keyed by name and labels
+#collectors are called at export time and return (name,type,labels,value) for values that are read rather than recorded
+class Metrics:
+    prefix='shredmeister_'
+    def __init__(self):
+        self.summaries=dict()
+        self.counters=collections.Counter()
+        self.collectors=list()
+        self.lock=threading.Lock()
+    def observe(self,name,value,**labels):
+        key=(name,tuple(sorted(labels.items())))
+        with self.lock:
+            summary=self.summaries.get(key)
+            if summary is None:
+                summary=self.summaries[key]=[0,0.0,value]
+            summary[0]+=1
+            summary[1]+=value
+            summary[2]=max(summary[2],value)
+    def increment(self,name,amount=1,**labels):
+        with self.lock:
+            self.counters[(name,tuple(sorted(labels.items())))]+=amount
+    def collect(self,collector):
+        self.collectors.append(collector)
+    #(count,sum,max) of a summary for each value of one label, merged over the others
+    def totals(self,name,label=None):
+        totals=dict()
+        with self.lock:
+            for (series,labels),(count,total,peak) in self.summaries.items():
+                if series != name:
+                    continue
+                value=dict(labels).get(label)
+                merged=totals.get(value,(0,0.0,0.0))
+                totals[value]=(merged[0]+count,merged[1]+total,max(merged[2],peak))
+        return totals
+    @staticmethod
+    def labels(labels):
+        if not labels:
+            return ''
+        escaped=(str(value).replace('\\','\\\\').replace('"','\\"').replace('\n','\\n') for _,value in labels)
+        return '{'+','.join(f'{key}="{value}"' for (key,_),value in zip(labels,escaped))+'}'
+    #all metrics in the Prometheus text exposition format, each family's samples together under its TYPE line
+    def export(self):
+        families=dict()
+        def add(name,kind,labels,value):
+            families.setdefault(self.prefix+name,(kind,list()))[1].append((labels,value))
+        with self.lock:
+            summaries=[(key,list(summary)) for key,summary in self.summaries.items()]
+            counters=list(self.counters.items())
+        for (name,labels),(count,total,peak) in summaries:
+            add(name,'summary',labels,(count,total))
+            add(name+'_max','gauge',labels,round(peak,6))
+        for (name,labels),value in counters:
+            add(name,'counter',labels,value)
+        for collector in self.collectors:
+            for name,kind,labels,value in collector():
+                add(name,kind,tuple(sorted(labels.items())),value)
+        lines=list()
+        for name,(kind,samples) in sorted(families.items()):
+            lines.append(f'# TYPE {name} {kind}')
+            for labels,value in samples:
+                if kind == 'summary':
+                    lines.append(f'{name}_count{self.labels(labels)} {value[0]}')
+                    lines.append(f'{name}_sum{self.labels(labels)} {value[1]:.6f}')
+                else:
+                    lines.append(f'{name}{self.labels(labels)} {value}')
+        return '\n'.join(lines)+'\n'
+
+metrics=Metrics()
+
+#--profile: the scan and refresh paths run under cProfile, with one profiler per thread, and the combined per-function
+#timings are printed and saved to this file on exit
+profile_path=None
+profile_top=30
+profile_state=threading.local()
+profiles=list()
+profiles_lock=threading.Lock()
+
+#times every call of a scan or refresh path function into function_seconds, and profiles it when --profile is given
+#only the outermost profiled call on a thread turns the profiler on, so nested ones are counted once
+def profiled(func):
+    name=func.__name__
+    @functools.wraps(func)
+    def wrapper(*args,**kwargs):
+        start=time.perf_counter()
+        profiler=None
+        if profile_path and not getattr(profile_state,'active',False):
+            profiler=getattr(profile_state,'profiler',None)
+            if profiler is None:
+                profiler=profile_state.profiler=cProfile.Profile()
+                with profiles_lock:
+                    profiles.append(profiler)
+            try:
+                profiler.enable()
+                profile_state.active=True
+            except ValueError:
+                #another profiler is already on, which newer Pythons only allow one of at a time
+                profiler=None
         try:
-            block=i.split('/')[-1]
-            serial=subprocess.check_output((['ssh',f'{login}'] if login else [])+['cat',f'/sys/block/{block}/device/serial']).rstrip().decode("utf-8")
-        except subprocess.CalledProcessError as e:
-            print(f'Unable to get serial for device {i} from virtual filesystem. Proceeding with smartctl method.')
-        else:
-            drives[serial]=i
-            continue
-        #fall back to reading json data
+            return func(*args,**kwargs)
+        finally:
+            if profiler:
+                profiler.disable()
+                profile_state.active=False
+            metrics.observe('function_seconds',time.perf_counter()-start,function=name)
+    return wrapper
+
+#print the slowest functions of the profiled paths by cumulative time and save the full statistics for pstats or snakeviz
+def print_profile():
+    with profiles_lock:
+        if not profile_path or not profiles:
+            return
+        stream=io.StringIO()
+        stats=pstats.Stats(profiles[0],stream=stream)
+        for profiler in profiles[1:]:
+            stats.add(profiler)
+    stats.dump_stats(profile_path)
+    stats.sort_stats('cumulative').print_stats(profile_top)
+    print(f'profile of the scan and refresh paths, saved to {profile_path}:')
+    print(stream.getvalue())
+
+#ssh client used for remote hosts; overridable with --ssh-command (e.g. a local stand-in shim)
+ssh_command='ssh'
+transports=dict()
+transports_lock=threading.Lock()
+
+#persistent connection to one host. remote commands are multiplexed over a single ssh ControlMaster
+#connection so only the first call pays for the handshake. login None runs commands locally through the same interface
+class Transport:
+    def __init__(self,login):
+        self.login=login
+        self.control_path=None
+        self.connected=False
+        self.lock=threading.Lock()
+    def __str__(self):
+        return self.login if self.login else 'local'
+    #start the master connection; blocks until authenticated, after which ssh backgrounds itself
+    def connect(self):
+        with self.lock:
+            if self.connected or not self.login:
+                return
+            self.control_path=os.path.join(tempfile.gettempdir(),f'shredmeister-{os.getpid()}-%C')
+            try:
+                subprocess.run([ssh_command,'-M','-N','-f','-o','ControlPersist=yes','-o',f'ControlPath={self.control_path}',self.login],check=True)
+            except (subprocess.CalledProcessError,OSError) as e:
+                #carry on without multiplexing; every command will do its own handshake
+                print(f'Unable to open persistent connection to {self.login}, falling back to one ssh per command:')
+                print(e)
+                self.control_path=None
+            self.connected=True
+    #arguments to put in front of a command so that it runs on this host
+    def prefix(self):
+        if not self.login:
+            return []
+        self.connect()
+        if self.control_path:
+            return [ssh_command,'-o','ControlMaster=no','-o',f'ControlPath={self.control_path}',self.login]
+        return [ssh_command,self.login]
+    #remote commands go through the remote shell, so quote them to behave the same as a local argv
+    def command(self,args):
+        if not self.login:
+            return list(args)
+        return self.prefix()+[shlex.join(args)]
+    #every command is timed into command_seconds by what it runs and where; failures and commands that could not start
+    #are counted in command_failures_total
+    def timed(self,call,args,**kwargs):
+        start=time.perf_counter()
+        returncode=None
         try:
-            data=json.loads(get_smart(i))
-            serial=data['serial_number']
-            #do not add drive if we can't get a serial
-            if serial is None:
-                raise TypeError
-        except TypeError as e:
-            print(f'Unable to get serial for device {i} from smartctl. Not populating.')
-        else:
-            print(f'Found serial {serial} for drive {i} through smartctl.')
-            drives[serial]=i
-    return drives
+            result=call(self.command(args),**kwargs)
+            returncode=getattr(result,'returncode',0)
+            return result
+        except subprocess.CalledProcessError as e:
+            returncode=e.returncode
+            raise
+        finally:
+            command=command_name(args)
+            metrics.observe('command_seconds',time.perf_counter()-start,command=command,host=str(self))
+            if returncode != 0:
+                metrics.increment('command_failures_total',command=command,host=str(self))
+    def run(self,args,**kwargs):
+        return self.timed(subprocess.run,args,**kwargs)
+    def popen(self,args,**kwargs):
+        return TimedPopen(self.command(args),command_name(args),str(self),**kwargs)
+    def check_output(self,args,**kwargs):
+        return self.timed(subprocess.check_output,args,**kwargs)
+    #time a no-op command n times; returns list of seconds per call
+    def latency(self,n=10):
+        timings=list()
+        for i in range(n):
+            start=time.perf_counter()
+            self.run(['true'],check=True)
+            timings.append(time.perf_counter()-start)
+        return timings
+    def close(self):
+        with self.lock:
+            if self.control_path:
+                subprocess.run([ssh_command,'-O','exit','-o',f'ControlPath={self.control_path}',self.login],stdout=subprocess.DEVNULL,stderr=subprocess.DEVNULL)
+                self.control_path=None
+            self.connected=False
 
-#returns list of mounted drives as a dict "{serial}"->"{path}"
-def get_mounted_drives():
-    try:
-        mount=subprocess.Popen((['ssh',f'{login}'] if login else [])+['mount'],stdout=subprocess.PIPE)
-        drives=re.findall(r'/dev/sd[a-z]|/dev/nvme[0-9]n[0-9]',mount.stdout.read().decode('utf-8'))
-        drive_paths=list(set(drives))
+#a started process that records how long it ran once its exit status is collected, by wait() or poll()
+#processes that were killed (cancelled jobs, readers closed early) are timed but not counted as failures
+class TimedPopen(subprocess.Popen):
+    def __init__(self,args,command,host,**kwargs):
+        self.command=command
+        self.host=host
+        self.started=time.perf_counter()
+        self.timed=False
+        super().__init__(args,**kwargs)
+    def finished(self):
+        if self.returncode is None or self.timed:
+            return
+        self.timed=True
+        metrics.observe('command_seconds',time.perf_counter()-self.started,command=self.command,host=self.host)
+        if self.returncode > 0:
+            metrics.increment('command_failures_total',command=self.command,host=self.host)
+    def poll(self):
+        returncode=super().poll()
+        self.finished()
+        return returncode
+    def wait(self,timeout=None):
+        returncode=super().wait(timeout)
+        self.finished()
+        return returncode
 
-    except subprocess.CalledProcessError as e:
-        print('Subprocess for get_mounted_drives() failed:')
-        print(e)
-        pass
-    return get_serials_from_drive_paths(drive_paths)
+#name a command is timed under: the program, or what the script does for the scripts run through sh -c
+def command_name(args):
+    if len(args) > 2 and args[0] == 'sh' and args[1] == '-c':
+        for script,name in ((DISCOVERY_SCRIPT,'discover'),(BATCH_SMARTCTL_SCRIPT,'smartctl-batch'),(REMOTE_ZERO_FILL_SCRIPT,'zero-fill'),(REMOTE_PATTERN_FILL_SCRIPT,'pattern-fill'),(DISCARD_LIMITS_SCRIPT,'discard-limits')):
+            if args[2].endswith(script):
+                return name
+        return 'sh'
+    return os.path.basename(args[0])
+
+#returns the shared transport for a host, creating it on first use
+def get_transport(login):
+    with transports_lock:
+        if login not in transports:
+            transports[login]=Transport(login)
+        return transports[login]
+
+def close_transports():
+    with transports_lock:
+        for transport in transports.values():
+            transport.close()
+        transports.clear()
+
+#print handshake and per-command latency for each host, to check the connection is actually being reused
+def bench_transport(hosts,n=20):
+    for host in hosts:
+        transport=get_transport(host)
+        start=time.perf_counter()
+        transport.connect()
+        handshake=time.perf_counter()-start
+        timings=transport.latency(n)
+        print(f'{transport}: connect {handshake*1000:.1f} ms, command min {min(timings)*1000:.1f} ms, median {statistics.median(timings)*1000:.1f} ms, max {max(timings)*1000:.1f} ms over {n} calls')
+
+#lists block devices with their sysfs serial (blank if unavailable), sysfs device path and discard limits (see
+#discard_limits()), then the mount table, then smartctl JSON for the requested drives. smartctl runs for all drives at
+#once in the background, so the whole pass is one invocation on the host and takes about as long as the slowest drive.
+#devices given as arguments are listed instead of every block device
+DISCOVERY_SCRIPT=r'''
+tmp=$(mktemp -d) || exit 1
+if [ -n "$sim_dir" ]; then
+    if [ $# -gt 0 ]; then
+        for dev; do [ -f "$dev" ] && echo "$dev"; done
+    else
+        find "$sim_dir" -type f -name '*.img' | sort
+    fi > "$tmp/devices"
+elif [ $# -gt 0 ]; then
+    for dev; do [ -b "$dev" ] && echo "$dev"; done > "$tmp/devices"
+else
+    find /dev -type b -regex '/dev/sd[a-x]+\|/dev/nvme[0-9]n[0-9]' > "$tmp/devices"
+fi
+while read dev; do
+    serial=$(cat "/sys/block/${dev##*/}/device/serial" 2>/dev/null)
+    q="/sys/block/${dev##*/}/queue"
+    printf '%s\t%s\t%s\t%s\n' "$dev" "$serial" "$(readlink -f "/sys/block/${dev##*/}")" "$(echo $(cat "$q/discard_max_bytes" "$q/discard_granularity" "$q/rotational" 2>/dev/null))"
+    if [ "$smart_all" = 1 ] || [ -z "$serial" ]; then
+        (smartctl -aj "$dev" > "$tmp/${dev##*/}.json"; echo $? > "$tmp/${dev##*/}.rc") &
+    fi
+done < "$tmp/devices"
+wait
+echo '#mounts'
+mount
+while read dev; do
+    if [ -e "$tmp/${dev##*/}.rc" ]; then
+        echo "#smart $dev $(cat "$tmp/${dev##*/}.rc")"
+        cat "$tmp/${dev##*/}.json"
+    fi
+done < "$tmp/devices"
+rm -rf "$tmp"
+'''
 
-#returns list of connected drives as a dict "{serial}"->"{path}"
-def get_drives():
+#sysfs device path and discard limits of each drive as last seen by discovery, keyed by (host,path)
+sysfs_paths=dict()
+queue_limits=dict()
+
+#detects connected drives, their mount state and SMART data in a single batched pass
+#returns (drives, mounted_drives, smart_data); the first two are dicts "{serial}"->"{path}", the last "{serial}"->parsed JSON
+#host is a login as given to --login, or None for this machine
+#with_smart=False only queries smartctl for drives whose serial isn't available from sysfs
+#drive_paths limits discovery to those devices
+@profiled
+def discover(host,with_smart=True,drive_paths=()):
+    drives=dict()
+    mounted_drives=dict()
+    smart_data=dict()
     try:
-        output=subprocess.Popen((['ssh',f'{login}'] if login else [])+['find','/dev','-type','b','-regex',(r'"/dev/sd[a-x]+\|/dev/nvme[0-9]n[0-9]"' if login else r'\'/dev/sd[a-x]+\|/dev/nvme[0-9]n[0-9]\'')],stdout=subprocess.PIPE)
-        drive_paths=output.stdout.read().decode('utf-8').splitlines()
-        print(drive_paths)
+        output=get_transport(host).run(['sh','-c',f'smart_all={1 if with_smart else 0}\nsim_dir={shlex.quote(simulated_devices or "")}\n'+DISCOVERY_SCRIPT,'sh']+list(drive_paths),stdout=subprocess.PIPE,check=True)
     except subprocess.CalledProcessError as e:
-        print('Subprocess for get_drives() failed:')
+        print(f'Subprocess for discover() on {get_transport(host)} failed:')
         print(e)
-    else:
-        return get_serials_from_drive_paths(drive_paths)
-
+        return drives,mounted_drives,smart_data
+    sysfs_serials=dict()
+    mount_table=list()
+    smart_output=dict()
+    section=None
+    for line in output.stdout.decode('utf-8',errors='replace').splitlines():
+        if line == '#mounts':
+            section=mount_table
+        elif line.startswith('#smart '):
+            _,path,returncode=line.split(' ')
+            section=smart_output[path]=[int(returncode)]
+        elif section is None:
+            path,_,serial=line.partition('\t')
+            serial,_,sysfs_path=serial.partition('\t')
+            sysfs_path,_,queue=sysfs_path.partition('\t')
+            sysfs_serials[path]=serial.rstrip()
+            sysfs_paths[(host,path)]=sysfs_path
+            queue_limits[(host,path)]=parse_discard_limits(queue)
+        else:
+            section.append(line)
+    mounted_paths=set(re.findall(r'/dev/sd[a-z]|/dev/nvme[0-9]n[0-9]','\n'.join(mount_table)))
+    for path,serial in sysfs_serials.items():
+        data=None
+        if path in smart_output:
+            returncode,*lines=smart_output[path]
+            data=load_smart(path,returncode,'\n'.join(lines))
+        #sysfs serial is faster but doesn't work with all drive types; fall back to reading json data
+        if not serial:
+            try:
+                serial=data['serial_number']
+                #do not add drive if we can't get a serial
+                if serial is None:
+                    raise TypeError
+            except (TypeError,KeyError) as e:
+                print(f'Unable to get serial for device {path} from smartctl. Not populating.')
+                continue
+            else:
+                print(f'Found serial {serial} for drive {path} through smartctl.')
+        drives[serial]=path
+        if path in mounted_paths:
+            mounted_drives[serial]=path
+        if data is not None:
+            smart_data[serial]=data
+    return drives,mounted_drives,smart_data
 
 #retrieve smart data as JSON
-def get_smart(drive_path):
+def get_smart(host,drive_path):
     try:
-        output=subprocess.run((['ssh',f'{login}'] if login else [])+['smartctl','-aj',drive_path],stdout=subprocess.PIPE)
+        output=get_transport(host).run(['smartctl','-aj',drive_path],stdout=subprocess.PIPE)
         data=output.stdout
         #check if bit 1 or 2 of the return code is set (command line did not parse or drive not found)
         if output.returncode & 3 :
@@ -106,272 +481,2317 @@ def get_smart(drive_path):
     else:
         return output.stdout
 
+#SMART JSON per drive, keyed by drive key and reused until it is older than max_age seconds
+#concurrent requests for the same drive share one smartctl call instead of each running their own
+class SmartCache:
+    #seconds before a drive whose read failed is read again; doubles with every failure in a row, up to retry_max
+    retry_after=30
+    retry_max=600
+    def __init__(self,max_age):
+        self.max_age=max_age
+        self.entries=dict()
+        #drive key: (time of the last failed read, failures in a row)
+        self.failures=dict()
+        self.pending=dict()
+        self.lock=threading.Lock()
+        self.hits=0
+        self.misses=0
+        self.shared=0
+    def __str__(self):
+        return f'SMART cache: {len(self.entries)} drives, {self.hits} hits, {self.misses} misses, {self.shared} shared'
+    def put(self,key,data):
+        with self.lock:
+            self.entries[key]=(time.monotonic(),data)
+        smart_history.record(key,data)
+    #drop cached data for a drive, or for all drives if key is None
+    def invalidate(self,key=None):
+        with self.lock:
+            if key is None:
+                self.entries.clear()
+                self.failures.clear()
+            else:
+                self.entries.pop(key,None)
+                self.failures.pop(key,None)
+    #cached data for a drive however old, or None; never queries the drive
+    def peek(self,key):
+        with self.lock:
+            entry=self.entries.get(key)
+        return entry and entry[1]
+    #whether a drive's cached data is missing or older than max_age
+    def stale(self,key):
+        with self.lock:
+            entry=self.entries.get(key)
+        return entry is None or time.monotonic()-entry[0] > self.max_age
+    #whether the last read of a drive failed too recently to try again
+    def failed_recently(self,key):
+        with self.lock:
+            failure=self.failures.get(key)
+        return failure is not None and time.monotonic()-failure[0] < min(self.retry_after*2**(failure[1]-1),self.retry_max)
+    #returns cached data for a Drive if fresh enough, otherwise queries the drive
+    #if the query fails, stale data is returned when there is any
+    def get(self,drive,max_age=None):
+        max_age=self.max_age if max_age is None else max_age
+        key=drive.key
+        with self.lock:
+            entry=self.entries.get(key)
+            if entry is not None and time.monotonic()-entry[0] <= max_age:
+                self.hits+=1
+                return entry[1]
+            future=self.pending.get(key)
+            owner=future is None
+            if owner:
+                self.misses+=1
+                future=self.pending[key]=concurrent.futures.Future()
+            else:
+                self.shared+=1
+        #another thread is already querying this drive
+        if not owner:
+            return future.result()
+        try:
+            data=json.loads(get_smart(drive.host,drive.path))
+        except (TypeError,ValueError) as e:
+            with self.lock:
+                del self.pending[key]
+                self.failures[key]=(time.monotonic(),self.failures.get(key,(0,0))[1]+1)
+            if entry is None:
+                future.set_exception(e)
+                raise
+            print(f'Using stale SMART data for {key}')
+            data=entry[1]
+        else:
+            with self.lock:
+                self.entries[key]=(time.monotonic(),data)
+                del self.pending[key]
+                self.failures.pop(key,None)
+            smart_history.record(key,data)
+        future.set_result(data)
+        return data
+
+smart_cache=SmartCache(60)
+
 #display popup with smartctl printout
-def popup_smart_data(drive_path):
+def popup_smart_data(host,drive_path):
     try:
-        output=subprocess.run((['ssh',f'{login}'] if login else [])+['smartctl','-a',drive_path],stdout=subprocess.PIPE)
+        output=get_transport(host).run(['smartctl','-a',drive_path],stdout=subprocess.PIPE)
     except:
         pass
     else:
         sg.popup_scrolled(output.stdout.decode('utf-8'),title=drive_path,font="Monospace 8")
 
-#initiate drive erasure; method dependent on drive type
+#returns (fd, size) for a drive or image file. O_DIRECT is used when the filesystem supports it
+#regular files are rounded up to a full block like shred does, so both leave the same bytes behind
+def open_direct(drive_path,flags):
+    try:
+        fd=os.open(drive_path,flags|os.O_DIRECT)
+    except OSError as e:
+        print(f'O_DIRECT not available for {drive_path}, using buffered I/O: {e}')
+        fd=os.open(drive_path,flags)
+    st=os.fstat(fd)
+    if stat.S_ISREG(st.st_mode) and flags & (os.O_WRONLY|os.O_RDWR):
+        size=st.st_size
+        if size % st.st_blksize:
+            size+=st.st_blksize-size % st.st_blksize
+    else:
+        size=os.lseek(fd,0,os.SEEK_END)
+    return fd,size
+
+#overwrite a drive with zeros from offset start using large aligned writes from one preallocated buffer, then fsync
+#progress(offset,size) is called after every write; stops early if cancelled is set
+#with synced, the drive is also fsynced every journal_checkpoint_interval seconds and synced(offset) told how far is on disk
+#returns number of bytes written
+def zero_fill(drive_path,block_size=erase_block_size,start=0,synced=None,progress=None,cancelled=None):
+    fd,size=open_direct(drive_path,os.O_WRONLY)
+    #anonymous mmap is page aligned and already zeroed, as O_DIRECT needs
+    buffer=mmap.mmap(-1,block_size)
+    view=memoryview(buffer)
+    offset=start
+    last_sync=time.monotonic()
+    try:
+        while offset < size:
+            if cancelled is not None and cancelled.is_set():
+                break
+            offset+=os.pwrite(fd,view[:min(block_size,size-offset)],offset)
+            if progress:
+                progress(offset,size)
+            if synced and time.monotonic()-last_sync >= journal_checkpoint_interval:
+                os.fsync(fd)
+                synced(offset)
+                last_sync=time.monotonic()
+        os.fsync(fd)
+        if synced:
+            synced(offset)
+    finally:
+        view.release()
+        buffer.close()
+        os.close(fd)
+    return offset-start
+
+#runs an in-process engine on a thread, with the parts of the Popen interface the rest of the program uses (poll, wait, terminate)
+#the engine is called as func(*args,progress=...,cancelled=...) and its return value is kept in result
+#failed(result) decides whether a run that completed should still exit non-zero
+class EngineJob:
+    def __init__(self,name,func,*args,tracker=None,failed=None):
+        self.name=name
+        self.func=func
+        self.args=args
+        self.tracker=tracker
+        self.failed=failed
+        self.result=None
+        self.returncode=None
+        self.done=0
+        self.size=None
+        self.callbacks=list()
+        self.lock=threading.Lock()
+        self.cancelled=threading.Event()
+        self.thread=threading.Thread(target=self.run,daemon=True)
+        self.thread.start()
+    def progress(self,done,size):
+        self.done=done
+        self.size=size
+        if self.tracker:
+            self.tracker.update(done,size)
+    def run(self):
+        try:
+            self.result=self.func(*self.args,progress=self.progress,cancelled=self.cancelled)
+        except OSError as e:
+            print(f'{self.name} failed:')
+            print(e)
+            self.returncode=1
+        else:
+            if self.cancelled.is_set():
+                self.returncode=-signal.SIGTERM
+            elif self.failed and self.failed(self.result):
+                self.returncode=1
+            else:
+                self.returncode=0
+        finally:
+            with self.lock:
+                callbacks,self.callbacks=self.callbacks,None
+            for callback in callbacks:
+                callback()
+    #call callback() from the job's thread once it finishes, or straight away if it already has
+    def add_done_callback(self,callback):
+        with self.lock:
+            if self.callbacks is not None:
+                self.callbacks.append(callback)
+                return
+        callback()
+    def poll(self):
+        return self.returncode
+    def wait(self,timeout=None):
+        self.thread.join(timeout)
+        return self.returncode
+    def terminate(self):
+        self.cancelled.set()
+
+#waits for jobs to finish on one thread and calls back as soon as each one exits, instead of polling them on a timer
+#processes are watched through a pidfd in a selector; in-process engines wake the selector through a pipe when they end
+#while jobs are running, tick() is called every interval seconds to update progress displays; otherwise the thread sleeps
+class JobWatcher:
+    def __init__(self,tick=None,interval=3):
+        self.tick=tick
+        self.interval=interval
+        self.selector=selectors.DefaultSelector()
+        self.wake_read,self.wake_write=os.pipe()
+        os.set_blocking(self.wake_read,False)
+        self.selector.register(self.wake_read,selectors.EVENT_READ,None)
+        self.lock=threading.Lock()
+        self.new_pidfds=list()
+        self.finished=list()
+        self.active=0
+        self.running=True
+        self.thread=threading.Thread(target=self.run,daemon=True)
+        self.thread.start()
+    def wake(self):
+        os.write(self.wake_write,b'\0')
+    def done(self,handle,callback):
+        with self.lock:
+            self.finished.append((handle,callback))
+        self.wake()
+    #call callback(returncode) on the watcher thread once handle (a Popen or EngineJob) exits
+    def watch(self,handle,callback):
+        with self.lock:
+            self.active+=1
+        if hasattr(handle,'add_done_callback'):
+            handle.add_done_callback(lambda: self.done(handle,callback))
+            return
+        try:
+            pidfd=os.pidfd_open(handle.pid)
+        except (AttributeError,OSError):
+            #no pidfd support, or the process was already reaped
+            threading.Thread(target=lambda: (handle.wait(),self.done(handle,callback)),daemon=True).start()
+            return
+        with self.lock:
+            self.new_pidfds.append((pidfd,handle,callback))
+        self.wake()
+    def run(self):
+        next_tick=time.monotonic()+self.interval
+        while self.running:
+            timeout=max(next_tick-time.monotonic(),0) if self.active else None
+            for key,mask in self.selector.select(timeout):
+                if key.data is None:
+                    while True:
+                        try:
+                            if not os.read(self.wake_read,4096):
+                                break
+                        except BlockingIOError:
+                            break
+                else:
+                    self.selector.unregister(key.fd)
+                    os.close(key.fd)
+                    with self.lock:
+                        self.finished.append(key.data)
+            with self.lock:
+                new_pidfds,self.new_pidfds=self.new_pidfds,list()
+                finished,self.finished=self.finished,list()
+            for pidfd,handle,callback in new_pidfds:
+                self.selector.register(pidfd,selectors.EVENT_READ,(handle,callback))
+            for handle,callback in finished:
+                returncode=handle.wait()
+                with self.lock:
+                    self.active-=1
+                callback(returncode)
+            if not self.active:
+                next_tick=time.monotonic()+self.interval
+            elif time.monotonic() >= next_tick:
+                next_tick=time.monotonic()+self.interval
+                if self.tick:
+                    #a failing tick mustn't take the watcher down with it, or no job would ever be reported finished
+                    try:
+                        self.tick()
+                    except Exception as e:
+                        print(f'Job watcher tick failed: {e!r}')
+    def stop(self):
+        self.running=False
+        self.wake()
+        self.thread.join()
+
+#states a job moves through, and where each can go next
+JOB_TRANSITIONS={
+    'queued':('running','cancelled'),
+    'running':('done','failed','cancelled'),
+    'done':(),
+    'failed':(),
+    'cancelled':(),
+}
+JOB_ACTIVE=('queued','running')
+
+#one erase, verification, surface scan or self-test of one drive; handle is its process, EngineJob or SelfTest once it is running
+class Job:
+    def __init__(self,serial,kind,state,handle=None):
+        self.serial=serial
+        self.kind=kind
+        self.state=state
+        self.handle=handle
+        self.result=None
+        self.created=time.monotonic()
+        self.changed=self.created
+        self.started=self.created if state == 'running' else None
+    def __repr__(self):
+        return f'Job({self.serial!r},{self.kind!r},{self.state!r})'
+
+#every job of every drive, indexed by serial and kind ('erase','verify','short','long','surface','quick'); only the newest job of each kind is kept
+#state changes are checked against JOB_TRANSITIONS under the lock, then each subscriber is called as callback(job,old_state)
+#from the thread that made the change (old_state None for a new job)
+class JobRegistry:
+    def __init__(self):
+        self.jobs=dict()
+        self.counts=collections.Counter()
+        self.lock=threading.Lock()
+        self.subscribers=list()
+    def __str__(self):
+        return 'jobs: '+', '.join(f'{count} {state}' for state,count in self.counts.items() if count)
+    def subscribe(self,callback):
+        self.subscribers.append(callback)
+    def notify(self,job,old_state):
+        for callback in self.subscribers:
+            callback(job,old_state)
+    #start tracking a job; raises ValueError if the drive already has one of this kind queued or running
+    def add(self,serial,kind,state='queued',handle=None):
+        with self.lock:
+            kinds=self.jobs.setdefault(serial,dict())
+            previous=kinds.get(kind)
+            if previous is not None:
+                if previous.state in JOB_ACTIVE:
+                    raise ValueError(f'{kind} of {serial} is already {previous.state}')
+                self.counts[previous.state]-=1
+            job=kinds[kind]=Job(serial,kind,state,handle)
+            self.counts[state]+=1
+        self.notify(job,None)
+        return job
+    #move a drive's job of this kind to state; returns the job, or None if it has none or can't go there from where it is
+    def transition(self,serial,kind,state,handle=None,result=None):
+        with self.lock:
+            job=self.jobs.get(serial,{}).get(kind)
+            if job is None or state not in JOB_TRANSITIONS[job.state]:
+                return None
+            old_state=job.state
+            self.counts[old_state]-=1
+            self.counts[state]+=1
+            job.state=state
+            job.changed=time.monotonic()
+            if state == 'running':
+                job.started=job.changed
+            if handle is not None:
+                job.handle=handle
+            if result is not None:
+                job.result=result
+        self.notify(job,old_state)
+        return job
+    def get(self,serial,kind):
+        return self.jobs.get(serial,{}).get(kind)
+    def state(self,serial,kind):
+        job=self.get(serial,kind)
+        return job and job.state
+    #True if the drive has a queued or running job of this kind, or of any kind if kind is None
+    def active(self,serial,kind=None):
+        kinds=self.jobs.get(serial,{})
+        if kind is not None:
+            return kind in kinds and kinds[kind].state in JOB_ACTIVE
+        return any(job.state in JOB_ACTIVE for job in list(kinds.values()))
+    #running jobs, of one kind or all
+    def running(self,kind=None):
+        with self.lock:
+            return [job for kinds in self.jobs.values() for job in kinds.values() if job.state == 'running' and kind in (None,job.kind)]
+    #cancel a drive's active jobs of the given kinds, stopping the ones that are running
+    def cancel(self,serial,kinds=('erase','verify','short','long','surface','quick')):
+        for kind in kinds:
+            job=self.transition(serial,kind,'cancelled')
+            if job is None or job.handle is None:
+                continue
+            if hasattr(job.handle,'cancel'):
+                job.handle.cancel()
+            else:
+                job.handle.terminate()
+
+jobs=JobRegistry()
+
+#stress a JobRegistry with n simulated drives, each taken through queued, running and an end state by one of threads workers
+#while other threads cancel jobs at random and poll active(); checks that the counts and every job's state add up
+def bench_jobs(n,threads=64):
+    registry=JobRegistry()
+    notified=collections.Counter()
+    notify_lock=threading.Lock()
+    def count(job,old_state):
+        with notify_lock:
+            notified[job.state]+=1
+    registry.subscribe(count)
+    kinds=('erase','verify','short','long')
+    stop=threading.Event()
+    def worker(serials):
+        for serial in serials:
+            for kind in kinds:
+                registry.add(serial,kind)
+                registry.transition(serial,kind,'running',handle=object())
+                registry.transition(serial,kind,random.choice(('done','failed')))
+    def canceller():
+        while not stop.is_set():
+            registry.transition(f'sim{random.randrange(n)}',random.choice(kinds),'cancelled')
+    def reader():
+        while not stop.is_set():
+            registry.active(f'sim{random.randrange(n)}')
+            registry.running('erase')
+    serials=[f'sim{i}' for i in range(n)]
+    others=[threading.Thread(target=canceller) for i in range(4)]+[threading.Thread(target=reader) for i in range(4)]
+    for thread in others:
+        thread.start()
+    start=time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(worker,[serials[i::threads] for i in range(threads)]))
+    elapsed=time.perf_counter()-start
+    stop.set()
+    for thread in others:
+        thread.join()
+    states=collections.Counter(job.state for kinds_ in registry.jobs.values() for job in kinds_.values())
+    total=sum(notified.values())
+    ok=states == +registry.counts and sum(states.values()) == n*len(kinds) and not states['queued'] and not states['running']
+    print(f'{n*len(kinds)} jobs on {threads} threads: {total} state changes in {elapsed:.2f} s ({total/elapsed:.0f}/s)')
+    print(f'final states: {dict(states)}; {"consistent" if ok else f"INCONSISTENT, registry counts {dict(registry.counts)}"}')
+    return ok
+
+#reads a drive into a caller's buffer at any offset
+#local drives are read with O_DIRECT; remote drives are streamed by dd over the host's transport, restarting it on a seek
+#sequential=False makes each remote read a separate dd that reads only what was asked for
+class DriveReader:
+    def __init__(self,drive_path,transport,sequential=True):
+        self.drive_path=drive_path
+        self.transport=transport
+        self.sequential=sequential
+        self.fd=None
+        self.proc=None
+        self.position=None
+        if transport.login:
+            self.size=int(transport.check_output(['blockdev','--getsize64',drive_path]))
+        else:
+            self.fd,self.size=open_direct(drive_path,os.O_RDONLY)
+    #fill view from offset; returns bytes read, which is only short at the end of the drive
+    def read_into(self,view,offset):
+        total=0
+        if self.fd is not None:
+            while total < len(view):
+                n=os.preadv(self.fd,[view[total:]],offset+total)
+                if n == 0:
+                    break
+                total+=n
+            return total
+        #a non-sequential reader's dd stops after one block, so even an adjacent sample needs a new one
+        if self.position != offset or not self.sequential:
+            self.close()
+            self.proc=self.transport.popen(['dd',f'if={self.drive_path}',f'bs={len(view)}',f'skip={offset}','iflag=direct,skip_bytes','status=none']+([] if self.sequential else ['count=1']),stdout=subprocess.PIPE)
+            self.position=offset
+        while total < len(view):
+            n=self.proc.stdout.readinto(view[total:])
+            if not n:
+                break
+            total+=n
+        self.position+=total
+        return total
+    def close(self):
+        if self.proc:
+            self.proc.kill()
+            self.proc.wait()
+            self.proc=None
+            self.position=None
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd=None
+
+#sector size used to locate non-zero data within a block
+VERIFY_SECTOR=4096
+
+#checks a block read from offset against what should be there, appending (offset,length) of sectors that differ to regions
+#expected is a bytearray at least as long as the block: zeros, or the pattern written by a random pass. it has to be a
+#bytearray on the left of the comparison, which is a memcmp; comparing from the memoryview's side goes byte by byte
+#the whole block is compared in one go first, since almost every block of an erased drive is clean
+#returns number of bytes found to differ, rounded to sectors
+def find_mismatch(view,offset,regions,expected):
+    if (expected if len(expected) == len(view) else expected[:len(view)]) == view:
+        return 0
+    found=0
+    for start in range(0,len(view),VERIFY_SECTOR):
+        sector=view[start:start+VERIFY_SECTOR]
+        if expected[start:start+len(sector)] == sector:
+            continue
+        found+=len(sector)
+        if regions and regions[-1][0]+regions[-1][1] == offset+start:
+            regions[-1]=(regions[-1][0],regions[-1][1]+len(sector))
+        elif len(regions) < verify_max_regions:
+            regions.append((offset+start,len(sector)))
+    return found
+
+#read the whole drive back into one reused buffer and check it is all zeros
+#returns (regions,nonzero_bytes,confidence); regions is a list of (offset,length) of non-zero data
+def verify_zero(drive_path,transport,block_size=verify_block_size,progress=None,cancelled=None):
+    reader=DriveReader(drive_path,transport)
+    buffer=mmap.mmap(-1,block_size)
+    view=memoryview(buffer)
+    zeros=bytearray(block_size)
+    regions=list()
+    nonzero_bytes=0
+    offset=0
+    try:
+        while offset < reader.size:
+            if cancelled is not None and cancelled.is_set():
+                break
+            n=reader.read_into(view[:min(block_size,reader.size-offset)],offset)
+            if n == 0:
+                raise OSError(f'Unexpected end of {drive_path} at offset {offset}')
+            nonzero_bytes+=find_mismatch(view[:n],offset,regions,zeros)
+            offset+=n
+            if progress:
+                progress(offset,reader.size)
+    finally:
+        reader.close()
+        view.release()
+        buffer.close()
+    return regions,nonzero_bytes,1.0
+
+#probability that n uniformly random samples hit at least one non-zero sample, if that fraction of the drive is non-zero
+def sample_confidence(n,fraction=None):
+    return 1-(1-(verify_detect_fraction if fraction is None else fraction))**n
+
+#read back randomly chosen ranges of the drive plus its head and tail (partition tables, primary and backup GPT,
+#most filesystem and RAID signatures) and check them with the same zero check as verify_zero()
+#with seed, each range is checked against that part of the random pattern instead of zeros
+#returns (regions,nonzero_bytes,confidence), confidence being sample_confidence() for the number of random ranges read
+def verify_sampled(drive_path,transport,samples=None,sample_size=verify_sample_size,progress=None,cancelled=None,seed=None):
+    samples=verify_samples if samples is None else samples
+    reader=DriveReader(drive_path,transport,sequential=False)
+    chunks=max(reader.size//sample_size,1)
+    picked=random.sample(range(chunks),min(samples,chunks))
+    offsets=sorted({0,max(reader.size-sample_size,0)}|{i*sample_size for i in picked})
+    total=sum(min(sample_size,reader.size-offset) for offset in offsets)
+    buffer=mmap.mmap(-1,sample_size)
+    view=memoryview(buffer)
+    zeros=bytearray(sample_size)
+    regions=list()
+    nonzero_bytes=0
+    done=0
+    try:
+        for offset in offsets:
+            if cancelled is not None and cancelled.is_set():
+                break
+            n=reader.read_into(view[:min(sample_size,reader.size-offset)],offset)
+            if n == 0:
+                raise OSError(f'Unexpected end of {drive_path} at offset {offset}')
+            if seed is not None:
+                with PatternStream(seed,offset) as stream:
+                    stream.read_into(memoryview(zeros)[:n])
+            nonzero_bytes+=find_mismatch(view[:n],offset,regions,zeros)
+            done+=n
+            if progress:
+                progress(done,total)
+    finally:
+        reader.close()
+        view.release()
+        buffer.close()
+    return regions,nonzero_bytes,sample_confidence(len(picked))
+
+#seeded random pattern for overwrite passes that can be verified without storing it: AES-128 in counter mode over zeros,
+#from openssl, with the key derived from the seed. the counter for byte offset is offset/16, so any part of the stream can be
+#regenerated on its own and a verification or a resumed pass only needs the seed. openssl runs as a process of its own, so each
+#drive's pattern is generated on its own core, several times faster than any one disk takes it
+def pattern_key(seed):
+    return hashlib.sha256(f'shredmeister pattern {seed}'.encode()).hexdigest()[:32]
+def new_pattern_seed():
+    return os.urandom(8).hex()
+#initialisation vector that starts the stream at offset, which must be a multiple of 16
+def pattern_iv(offset):
+    if offset % 16:
+        raise ValueError(f'pattern offset {offset} is not a multiple of 16')
+    return f'{offset//16:032x}'
+
+#the pattern for seed from offset onwards, read from a local openssl process
+class PatternStream:
+    #larger than the default 64 KiB so openssl isn't woken for every few reads
+    pipe_size=1024*1024
+    def __init__(self,seed,offset=0):
+        with open('/dev/zero','rb') as zeros:
+            self.proc=get_transport(None).popen(['openssl','enc','-aes-128-ctr','-nosalt','-K',pattern_key(seed),'-iv',pattern_iv(offset)],stdin=zeros,stdout=subprocess.PIPE,bufsize=0)
+        try:
+            fcntl.fcntl(self.proc.stdout,fcntl.F_SETPIPE_SZ,self.pipe_size)
+        except OSError:
+            pass
+    def __enter__(self):
+        return self
+    def __exit__(self,*exc_info):
+        self.close()
+    #fill view with the next len(view) bytes of the pattern
+    def read_into(self,view):
+        total=0
+        while total < len(view):
+            n=self.proc.stdout.readinto(view[total:])
+            if not n:
+                raise OSError(f'openssl stopped after {total} bytes of the pattern')
+            total+=n
+        return total
+    def close(self):
+        self.proc.kill()
+        self.proc.wait()
+        self.proc.stdout.close()
+
+#fills buffers a block ahead of the caller on a thread of its own, so producing the next block overlaps with using this one
+#fill(view,offset) is called for each block from start to size; yields (offset,buffer,length) and a buffer is only
+#refilled once the next block is taken. errors from fill are raised in the caller
+def prefetch(fill,buffers,start,size):
+    free=queue.Queue()
+    filled=queue.Queue()
+    for buffer in buffers:
+        free.put(buffer)
+    def run():
+        offset=start
+        try:
+            while offset < size:
+                buffer=free.get()
+                if buffer is None:
+                    return
+                length=min(len(buffer),size-offset)
+                fill(memoryview(buffer)[:length],offset)
+                filled.put((offset,buffer,length))
+                offset+=length
+            filled.put(None)
+        except OSError as e:
+            filled.put(e)
+    threading.Thread(target=run,daemon=True).start()
+    try:
+        while (item := filled.get()) is not None:
+            if isinstance(item,OSError):
+                raise item
+            yield item
+            free.put(item[1])
+    finally:
+        #stops the thread if the caller gave up early
+        free.put(None)
+
+#overwrite a drive with the pattern for seed from offset start, with the same large direct writes, fsyncs and checkpoints as
+#zero_fill(); the pattern for the next block is generated while this one is written
+#returns number of bytes written
+def pattern_fill(drive_path,seed,block_size=erase_block_size,start=0,synced=None,progress=None,cancelled=None):
+    fd,size=open_direct(drive_path,os.O_WRONLY)
+    try:
+        stream=PatternStream(seed,start)
+    except OSError:
+        os.close(fd)
+        raise
+    #anonymous mmaps are page aligned, as O_DIRECT needs
+    blocks=prefetch(lambda view,offset: stream.read_into(view),[mmap.mmap(-1,block_size) for i in range(2)],start,size)
+    offset=start
+    last_sync=time.monotonic()
+    try:
+        for offset,buffer,length in blocks:
+            if cancelled is not None and cancelled.is_set():
+                break
+            with memoryview(buffer) as view:
+                written=0
+                while written < length:
+                    written+=os.pwrite(fd,view[written:length],offset+written)
+            offset+=length
+            if progress:
+                progress(offset,size)
+            if synced and time.monotonic()-last_sync >= journal_checkpoint_interval:
+                os.fsync(fd)
+                synced(offset)
+                last_sync=time.monotonic()
+        os.fsync(fd)
+        if synced:
+            synced(offset)
+    finally:
+        blocks.close()
+        stream.close()
+        os.close(fd)
+    return offset-start
+
+#read the whole drive back and compare it with the pattern regenerated from seed, a block ahead on its own thread
+#returns (regions,mismatched_bytes,confidence) like verify_zero()
+def verify_pattern(drive_path,transport,seed,block_size=verify_block_size,progress=None,cancelled=None):
+    reader=DriveReader(drive_path,transport)
+    try:
+        stream=PatternStream(seed)
+    except OSError:
+        reader.close()
+        raise
+    #bytearrays, for find_mismatch()
+    blocks=prefetch(lambda view,offset: stream.read_into(view),[bytearray(block_size) for i in range(2)],0,reader.size)
+    buffer=mmap.mmap(-1,block_size)
+    view=memoryview(buffer)
+    regions=list()
+    mismatched_bytes=0
+    try:
+        for offset,expected,length in blocks:
+            if cancelled is not None and cancelled.is_set():
+                break
+            n=reader.read_into(view[:length],offset)
+            if n < length:
+                raise OSError(f'Unexpected end of {drive_path} at offset {offset+n}')
+            mismatched_bytes+=find_mismatch(view[:n],offset,regions,expected)
+            if progress:
+                progress(offset+n,reader.size)
+    finally:
+        blocks.close()
+        stream.close()
+        reader.close()
+        view.release()
+        buffer.close()
+    return regions,mismatched_bytes,1.0
+
+#start a read-back of a drive in the background, either 'full' or 'sampled'; the job exits non-zero if anything but zeros was found
+#a drive last erased with a random pattern is checked against the pattern regenerated from its seed
+def verify_drive(host,drive_path,progress,mode='full',seed=None):
+    if drive_path != None:
+        check=verify_sampled if mode == 'sampled' else verify_zero
+        if seed is not None:
+            check=functools.partial(verify_sampled if mode == 'sampled' else verify_pattern,seed=seed)
+        return EngineJob(f'Verification of {drive_path} on {get_transport(host)}',check,drive_path,get_transport(host),tracker=progress,failed=lambda result: result[1] > 0)
+
+#record a finished verification on its drive
+def finish_verify(serial,job):
+    drive=all_drives[serial]
+    verify_progress.pop(serial,None)
+    drive.verified=job.returncode == 0
+    if job.result:
+        drive.nonzero_regions,nonzero_bytes,drive.verify_confidence=job.result
+        if nonzero_bytes:
+            print(f'{serial}: {humanize.naturalsize(nonzero_bytes)} of {"data not matching the random pattern" if drive.pattern_seed else "non-zero data"} in {len(drive.nonzero_regions)} regions, first at offset {drive.nonzero_regions[0][0]}')
+        elif drive.verify_confidence < 1:
+            print(f'{serial}: sampled verification is {drive.verify_confidence:.3%} confident that less than {verify_detect_fraction:.2%} of the drive is non-zero')
+    print(f'{serial}: verification {"passed" if drive.verified else "failed"}')
+    journal.record(drive,verified=drive.verified,verify_confidence=drive.verify_confidence)
+    jobs.transition(serial,'verify','done' if drive.verified else 'cancelled' if job.returncode == -signal.SIGTERM else 'failed',result=job.result)
+
+#read-only surface scan, for grading drives before they are erased: every block (or every surface_stride-th) is read
+#in order and timed; read latencies go into a histogram, throughput into a curve across the drive, and slow or unreadable
+#blocks are listed as regions
+surface_block_size=4*1024*1024
+#--surface-stride: 1 reads the whole drive, N reads one block in every N
+surface_stride=1
+#the throughput curve has this many points, one per equal share of the drive
+surface_zones=100
+#blocks taking this many seconds or more to read are reported as slow
+surface_slow_latency=0.3
+#upper bounds of the latency histogram's buckets in milliseconds; the last bucket counts everything slower
+SURFACE_BUCKETS=(1,2,5,10,20,50,100,200,500,1000,2000,5000)
+#at most this many slow and unreadable regions are kept each
+surface_max_regions=100
+#progress of running surface scans
+surface_progress=dict()
+
+#add (offset,length,...) to a list of regions, merging it into the last one if they touch; extra fields keep their largest value
+def add_region(regions,offset,length,*extra):
+    if regions and regions[-1][0]+regions[-1][1] == offset:
+        last=regions[-1]
+        regions[-1]=[last[0],last[1]+length]+[max(a,b) for a,b in zip(last[2:],extra)]
+    elif len(regions) < surface_max_regions:
+        regions.append([offset,length,*extra])
+
+#scan a drive, returning a dict that can be saved as JSON: the latency histogram (counts per SURFACE_BUCKETS bucket), the
+#throughput of each zone in bytes per second, slow regions as [offset,length,worst latency in ms] and unreadable regions as
+#[offset,length]. a block that can't be read is recorded and skipped, so one bad patch doesn't end the scan
+def surface_scan(drive_path,transport,stride=None,block_size=surface_block_size,progress=None,cancelled=None):
+    stride=surface_stride if stride is None else stride
+    reader=DriveReader(drive_path,transport,sequential=stride == 1)
+    buffer=mmap.mmap(-1,block_size)
+    view=memoryview(buffer)
+    offsets=range(0,reader.size,block_size*stride)
+    #a small drive gets a point per block read
+    zones=max(min(surface_zones,len(offsets)),1)
+    histogram=array.array('L',[0]*(len(SURFACE_BUCKETS)+1))
+    zone_bytes=array.array('d',[0.0]*zones)
+    zone_seconds=array.array('d',[0.0]*zones)
+    slow=list()
+    errors=list()
+    scanned=0
+    start=time.monotonic()
+    try:
+        for i,offset in enumerate(offsets):
+            if cancelled is not None and cancelled.is_set():
+                break
+            length=min(block_size,reader.size-offset)
+            began=time.perf_counter()
+            try:
+                n=reader.read_into(view[:length],offset)
+            except OSError as e:
+                print(f'{drive_path}: read error at offset {offset}: {e}')
+                n=0
+            latency=time.perf_counter()-began
+            #the reader starts afresh at the next block, as it isn't where this one ended
+            if n < length:
+                add_region(errors,offset+n,length-n)
+            histogram[bisect.bisect_left(SURFACE_BUCKETS,latency*1000)]+=1
+            zone=i*zones//len(offsets)
+            zone_bytes[zone]+=n
+            zone_seconds[zone]+=latency
+            if latency >= surface_slow_latency:
+                add_region(slow,offset,length,round(latency*1000))
+            scanned+=n
+            if progress:
+                progress((i+1)*block_size if stride > 1 else offset+length,len(offsets)*block_size if stride > 1 else reader.size)
+    finally:
+        reader.close()
+        view.release()
+        buffer.close()
+    return {'time':round(time.time()),'stride':stride,'block_size':block_size,'bytes':scanned,'seconds':round(time.monotonic()-start,3),
+        'histogram':list(histogram),'zones':[round(b/s) if s else None for b,s in zip(zone_bytes,zone_seconds)],'slow':slow,'errors':errors}
+
+#start a surface scan of a drive in the background; the job exits non-zero if any block couldn't be read
+def surface_scan_drive(host,drive_path,progress,stride=None):
+    if drive_path != None:
+        return EngineJob(f'Surface scan of {drive_path} on {get_transport(host)}',surface_scan,drive_path,get_transport(host),stride,tracker=progress,failed=lambda result: bool(result['errors']))
+
+#record a finished surface scan on its drive
+def finish_surface_scan(serial,job):
+    drive=all_drives[serial]
+    surface_progress.pop(serial,None)
+    if job.result:
+        drive.surface_scan=job.result
+        journal.record(drive,surface_scan=job.result)
+    print(f'{serial}: surface scan {surface_summary(drive.surface_scan) if job.result else "did not finish"}')
+    jobs.transition(serial,'surface','done' if job.returncode == 0 else 'cancelled' if job.returncode == -signal.SIGTERM else 'failed',result=job.result)
+
+#one line verdict of a surface scan result
+def surface_summary(result):
+    if not result:
+        return "❌"
+    rates=[rate for rate in result['zones'] if rate is not None]
+    speed=f"{humanize.naturalsize(result['bytes']/result['seconds'] if result['seconds'] else 0)}/s, slowest zone {humanize.naturalsize(min(rates) if rates else 0)}/s"
+    sampled=f", 1 in {result['stride']} blocks" if result['stride'] > 1 else ''
+    if result['errors']:
+        return f"❌ {len(result['errors'])} unreadable regions, first at offset {result['errors'][0][0]} ({speed}{sampled})"
+    return f"✔ {speed}, {len(result['slow'])} slow regions{sampled}"
+
+#the latency histogram, as "<1ms 12 <2ms 3400 ..." for the buckets that have anything in them, and the throughput curve as a
+#row of bars, each the average of a few zones
+SPARK=' ▁▂▃▄▅▆▇█'
+def surface_details(result,width=50):
+    if not result:
+        return ''
+    labels=[f'<{bound}ms' for bound in SURFACE_BUCKETS]+[f'≥{SURFACE_BUCKETS[-1]}ms']
+    histogram=' '.join(f'{label} {count}' for label,count in zip(labels,result['histogram']) if count)
+    zones=result['zones']
+    step=max(len(zones)//width,1)
+    points=[statistics.fmean(rates) if (rates := [rate for rate in zones[i:i+step] if rate is not None]) else 0 for i in range(0,len(zones),step)]
+    top=max(points) or 1
+    curve=''.join(SPARK[round(point/top*(len(SPARK)-1))] for point in points)
+    return f'Latency: {histogram}\nThroughput: {curve} (peak {humanize.naturalsize(top)}/s)'
+
+#quick wipe: how much to zero at each end of the drive and of every partition, in MiB
+quick_wipe_size=8
+#btrfs keeps copies of its superblock this far into the filesystem, past what the ends cover
+BTRFS_MIRRORS=(64*1024**2,256*1024**3)
+#MBR partition types that hold a chain of logical partitions
+MBR_EXTENDED=(0x05,0x0f,0x85)
+
+#bytes [offset,offset+length) of a drive, read in whole 4 KiB blocks as O_DIRECT needs; short at the end of the drive
+def read_bytes(reader,offset,length):
+    start=offset-offset%4096
+    buffer=mmap.mmap(-1,-(-(offset+length-start)//4096)*4096)
+    n=reader.read_into(memoryview(buffer),start)
+    return bytes(buffer[offset-start:n])[:length]
+
+#(type,first sector,sectors) of entry i of an MBR or EBR
+def mbr_entry(sector,i):
+    return (sector[446+16*i+4],*struct.unpack_from('<II',sector,446+16*i+8))
+
+#partitions of a drive as (start,length) in bytes: from its GPT, or the backup GPT at the end when the primary is damaged,
+#otherwise from its MBR, following extended partitions to the logical ones inside. a drive without a table has none
+#MBRs are read as 512 byte sectors, GPTs as 512 or 4096
+def partition_table(reader):
+    partitions=list()
+    for sector in (512,4096):
+        for header_offset in (sector,reader.size-sector):
+            header=read_bytes(reader,header_offset,sector)
+            if header[:8] != b'EFI PART':
+                continue
+            header_size,crc=struct.unpack_from('<II',header,12)
+            if not 92 <= header_size <= sector or zlib.crc32(header[:16]+bytes(4)+header[20:header_size]) != crc:
+                continue
+            entries_lba,count,entry_size=struct.unpack_from('<QII',header,72)
+            if entry_size < 128 or count*entry_size > 1024**2:
+                continue
+            entries=read_bytes(reader,entries_lba*sector,count*entry_size)
+            for i in range(0,len(entries)-entry_size+1,entry_size):
+                if any(entries[i:i+16]):
+                    first,last=struct.unpack_from('<QQ',entries,i+32)
+                    partitions.append((first*sector,(last-first+1)*sector))
+            return [(start,min(length,reader.size-start)) for start,length in partitions if start < reader.size]
+    mbr=read_bytes(reader,0,512)
+    if mbr[510:512] != b'\x55\xaa':
+        return partitions
+    for i in range(4):
+        kind,first,sectors=mbr_entry(mbr,i)
+        if not kind or not sectors or kind == 0xee:
+            continue
+        partitions.append((first*512,sectors*512))
+        if kind in MBR_EXTENDED:
+            #each EBR holds a logical partition, relative to itself, and a link to the next EBR, relative to the extended one
+            ebr_offset=first*512
+            for j in range(128):
+                ebr=read_bytes(reader,ebr_offset,512)
+                if ebr[510:512] != b'\x55\xaa':
+                    break
+                kind,logical_first,logical_sectors=mbr_entry(ebr,0)
+                if kind and logical_sectors:
+                    partitions.append((ebr_offset+logical_first*512,logical_sectors*512))
+                kind,next_first,next_sectors=mbr_entry(ebr,1)
+                if not kind or not next_first:
+                    break
+                ebr_offset=first*512+next_first*512
+    return [(start,min(length,reader.size-start)) for start,length in partitions if start < reader.size]
+
+#the regions quick_wipe() zeros, as sorted (offset,length) that don't overlap: the first and last size bytes of the drive,
+#which hold the MBR, both GPTs and the RAID, LVM and filesystem signatures of a drive used whole, the same for every
+#partition, and the btrfs superblock mirrors of each
+def quick_wipe_regions(drive_size,partitions,size):
+    regions=list()
+    for start,length in [(0,drive_size)]+partitions:
+        regions.append((start,min(size,length)))
+        regions.append((start+max(length-size,0),min(size,length)))
+        regions+=[(start+mirror,4096) for mirror in BTRFS_MIRRORS if mirror+4096 <= length]
+    merged=list()
+    for offset,length in sorted(regions):
+        if merged and offset <= merged[-1][0]+merged[-1][1]:
+            merged[-1]=(merged[-1][0],max(merged[-1][1],offset+length-merged[-1][0]))
+        else:
+            merged.append((offset,length))
+    return merged
+
+#signature types wipefs still finds on a drive, as ['ext4 at 0x438',...]; None if wipefs couldn't be run
+def remaining_signatures(drive_path,transport):
+    try:
+        result=transport.run(['wipefs','--json',drive_path],stdout=subprocess.PIPE,stderr=subprocess.PIPE,text=True)
+    except OSError:
+        return None
+    if result.returncode:
+        print(f'Unable to check {drive_path} for signatures: {result.stderr.strip()}')
+        return None
+    if not result.stdout.strip():
+        return []
+    try:
+        return [f"{signature['type']} at {signature['offset']}" for signature in json.loads(result.stdout)['signatures']]
+    except (ValueError,KeyError,TypeError):
+        return None
+
+#make a drive unreadable in seconds by zeroing its partition tables, its signatures and the ends of it and of every
+#partition, leaving the rest of the data for a full erase; the kernel is then told to forget the partitions
+#zeroing goes through dd on the drive's host, so it is the same for local and remote drives
+def quick_wipe(drive_path,transport,size_mib=None,progress=None,cancelled=None):
+    size=(quick_wipe_size if size_mib is None else size_mib)*1024**2
+    start=time.monotonic()
+    reader=DriveReader(drive_path,transport,sequential=False)
+    try:
+        partitions=partition_table(reader)
+    finally:
+        reader.close()
+    regions=quick_wipe_regions(reader.size,partitions,size)
+    total=sum(length for offset,length in regions)
+    done=0
+    for offset,length in regions:
+        if cancelled is not None and cancelled.is_set():
+            break
+        result=transport.run(['dd','if=/dev/zero',f'of={drive_path}','bs=1M',f'seek={offset}',f'count={length}','iflag=count_bytes','oflag=seek_bytes','conv=notrunc,fsync','status=none'],stderr=subprocess.PIPE,text=True)
+        if result.returncode:
+            raise OSError(f'Unable to zero {length} bytes at offset {offset} of {drive_path}: {result.stderr.strip()}')
+        done+=length
+        if progress is not None:
+            progress(done,total)
+    transport.run(['blockdev','--rereadpt',drive_path],stdout=subprocess.DEVNULL,stderr=subprocess.DEVNULL)
+    return {'time':round(time.time()),'size_mib':size//1024**2,'partitions':len(partitions),'regions':regions,'bytes':done,'seconds':round(time.monotonic()-start,3),'signatures':remaining_signatures(drive_path,transport)}
+
+def quick_wipe_drive(host,drive_path,progress=None):
+    if drive_path != None:
+        return EngineJob(f'Quick wipe of {drive_path} on {get_transport(host)}',quick_wipe,drive_path,get_transport(host),tracker=progress,failed=lambda result: bool(result['signatures']) or result['bytes'] < sum(length for offset,length in result['regions']))
+
+#start a quick wipe of a drive and return its job; the zeroed regions break whatever pattern the last erase wrote, so the
+#drive is no longer verified and its pattern seed is dropped
+def start_quick_wipe(serial):
+    drive=all_drives[serial]
+    drive.verified=False
+    drive.pattern_seed=None
+    journal.record(drive,verified=False,pattern_seed=None)
+    job=quick_wipe_drive(drive.host,str(drive.path))
+    jobs.add(serial,'quick','running',job)
+    return job
+
+#record a finished quick wipe on its drive; a drive is only marked quick-wiped when every region was zeroed and no
+#signature is left
+def finish_quick_wipe(serial,job):
+    drive=all_drives[serial]
+    if job.returncode == 0:
+        drive.quick_wiped=job.result
+        journal.record(drive,quick_wiped=job.result)
+    print(f'{serial}: quick wipe {quick_wipe_summary(job.result)}')
+    jobs.transition(serial,'quick','done' if job.returncode == 0 else 'cancelled' if job.returncode == -signal.SIGTERM else 'failed',result=job.result)
+
+#one line verdict of a quick wipe result
+def quick_wipe_summary(result):
+    if not result:
+        return "did not finish"
+    zeroed=f"{humanize.naturalsize(result['bytes'],binary=True)} in {len(result['regions'])} regions, {result['partitions']} partitions, {result['seconds']:.1f} s"
+    if result['bytes'] < sum(length for offset,length in result['regions']):
+        return f"❌ cancelled after {zeroed}"
+    if result['signatures']:
+        return f"❌ signatures left: {', '.join(result['signatures'])} ({zeroed})"
+    return f"✔ {zeroed}{'' if result['signatures'] is not None else ', signatures not checked'}"
+
+#native engine on a remote host: the same large direct writes and final sync, done by dd
+#$3 is the offset to start from, when resuming
+REMOTE_ZERO_FILL_SCRIPT='''
+size=$(blockdev --getsize64 "$1") || exit 1
+exec dd if=/dev/zero of="$1" bs="$2" seek="$3" count=$((size-$3)) iflag=count_bytes oflag=direct,seek_bytes conv=fsync status=progress
+'''
+#random pattern on a remote host, generated there by openssl; $4 and $5 are pattern_key() and pattern_iv() for offset $3
+REMOTE_PATTERN_FILL_SCRIPT='''
+size=$(blockdev --getsize64 "$1") || exit 1
+openssl enc -aes-128-ctr -nosalt -K "$4" -iv "$5" < /dev/zero 2>/dev/null |
+    dd of="$1" bs="$2" seek="$3" count=$((size-$3)) iflag=count_bytes,fullblock oflag=direct,seek_bytes conv=fsync status=progress
+'''
+
+#tracks how far an erase or verification has got; rates are in bytes per second
+#offset is where a resumed job started; done counts from the start of the drive
+class JobProgress:
+    #the current rate is measured over this many seconds; shred only reports 2-3 significant digits, so keep it long
+    window=30
+    def __init__(self,size,offset=0):
+        self.size=size
+        self.offset=offset
+        self.done=offset
+        #how far is known to be flushed to the drive, for engines that say so
+        self.synced=None
+        self.start=time.monotonic()
+        self.samples=collections.deque([(self.start,offset)])
+        self.slow=False
+        #how far the last update moved on; coarse output like shred's past 1 TiB moves in steps of minutes
+        self.step=0
+    def update(self,done,size=None):
+        now=time.monotonic()
+        if size:
+            self.size=size
+        if done > self.done:
+            self.step=done-self.done
+        self.done=done
+        self.samples.append((now,done))
+        while len(self.samples) > 2 and now-self.samples[1][0] >= self.window:
+            self.samples.popleft()
+    #measured up to now rather than the last update, so a stalled drive drops towards zero
+    def current_rate(self):
+        elapsed=time.monotonic()-self.samples[0][0]
+        return (self.done-self.samples[0][1])/elapsed if elapsed > 0 else 0.0
+    def average_rate(self):
+        elapsed=time.monotonic()-self.start
+        return (self.done-self.offset)/elapsed if elapsed > 0 else 0.0
+    def mark_synced(self,offset):
+        self.synced=offset
+    #seconds remaining, or None if unknown
+    def eta(self):
+        rate=self.current_rate() or self.average_rate()
+        if not self.size or not rate:
+            return None
+        return max(self.size-self.done,0)/rate
+    def percent(self):
+        return 100*self.done/self.size if self.size else 0.0
+    def __str__(self):
+        eta=self.eta()
+        return (f'{self.percent():.1f}% {humanize.naturalsize(self.current_rate())}/s (avg {humanize.naturalsize(self.average_rate())}/s) '
+            f'ETA {"?" if eta is None else datetime.timedelta(seconds=int(eta))}{" SLOW" if self.slow else ""}')
+
+#flag erases running well below the median current speed of all erases that have been running for a while
+#a drive whose progress moves in steps of more than a quarter of what the rate window covers isn't judged, as its current
+#rate swings with where the window falls between steps
+def check_slow_drives():
+    now=time.monotonic()
+    rates=dict()
+    for serial,progress in list(erase_progress.items()):
+        if now-progress.start >= JobProgress.window and progress.step*4 <= progress.average_rate()*JobProgress.window:
+            rates[serial]=progress,progress.current_rate()
+        else:
+            progress.slow=False
+    if len(rates) < 2:
+        return
+    median=statistics.median(rate for progress,rate in rates.values())
+    #erases finishing meanwhile leave erase_progress on the GUI thread; only the progress taken above is touched
+    for serial,(progress,rate) in rates.items():
+        slow=rate < slow_fraction*median
+        if slow and not progress.slow:
+            print(f'{serial} is erasing at {humanize.naturalsize(rate)}/s, below {slow_fraction:.0%} of the median {humanize.naturalsize(median)}/s')
+        progress.slow=slow
+
+UNITS={'':1,'K':1024,'M':1024**2,'G':1024**3,'T':1024**4,'P':1024**5,'E':1024**6}
+
+#parsers for the progress output of erase commands; each returns (bytes_done,size) or None
+#shred -v: "shred: /dev/sdb: pass 1/1 (000000)...2.8GiB/3.0GiB 94%"
+def parse_shred_progress(line):
+    match=re.search(r'\.\.\.([\d.]+)([KMGTPE]?)i?B?/([\d.]+)([KMGTPE]?)i?B? (\d+)%',line)
+    if match:
+        return float(match[1])*UNITS[match[2]],float(match[3])*UNITS[match[4]]
+#blkdiscard -v -p: "/dev/sdb: Discarded 1073741824 bytes from the offset 0", counting bytes since the previous line
+def parse_discard_progress(line):
+    match=re.search(r'(\d+) bytes from the offset (\d+)',line)
+    if match:
+        return int(match[1])+int(match[2]),None
+#dd status=progress: "1048576000 bytes (1.0 GB, 1000 MiB) copied, 5 s, 210 MB/s"
+def parse_dd_progress(line):
+    match=re.match(r'(\d+) bytes',line.strip())
+    if match:
+        return int(match[1]),None
+
+#read an erase command's progress output and feed it to its tracker; anything else is passed through
+#commands report bytes since they started, so a resumed command's progress is counted from progress.offset
+#progress never goes back, as watch_position() may have seen further than the command's rounded figures
+def watch_progress(stream,parse,progress):
+    for line in io.TextIOWrapper(stream,errors='replace'):
+        parsed=parse(line)
+        if parsed:
+            progress.update(max(progress.offset+int(parsed[0]),progress.done),parsed[1] and int(parsed[1]))
+        else:
+            print(line,end='')
+
+#position of a local process's file descriptor on drive_path, from /proc; None if it has none open there (not yet, or
+#any more)
+def fd_position(pid,drive_path):
+    target=os.path.realpath(drive_path)
+    try:
+        fds=os.listdir(f'/proc/{pid}/fd')
+    except OSError:
+        return None
+    for fd in fds:
+        try:
+            if os.readlink(f'/proc/{pid}/fd/{fd}') != target:
+                continue
+            with open(f'/proc/{pid}/fdinfo/{fd}') as fdinfo:
+                for line in fdinfo:
+                    if line.startswith('pos:'):
+                        return int(line.split()[1])
+        except (OSError,ValueError):
+            continue
+    return None
+
+#follow a local erase command by where it is writing, once a second until its output ends; exact where the figures it
+#prints are rounded
+def watch_position(proc,drive_path,progress,reader):
+    while reader.is_alive():
+        position=fd_position(proc.pid,drive_path)
+        if position is not None and progress.offset+position > progress.done:
+            progress.update(progress.offset+position)
+        time.sleep(1)
+
+#start an erase command with its progress output piped to watch_progress(), and a local one watched by watch_position()
+#too; the output's reader is kept as proc.progress_reader, so the last of it can be waited for
+def popen_with_progress(host,args,pipe,parse,progress):
+    proc=get_transport(host).popen(args,**{pipe:subprocess.PIPE})
+    proc.progress_reader=threading.Thread(target=watch_progress,args=(getattr(proc,pipe),parse,progress),daemon=True)
+    proc.progress_reader.start()
+    if not host:
+        threading.Thread(target=watch_position,args=(proc,args[-1],progress,proc.progress_reader),daemon=True).start()
+    return proc
+
+#discard limits from a drive's sysfs queue: discard_max_bytes, discard_granularity and rotational; empty if there are none
+#the kernel doesn't list secure discard support there, so that is found out by trying it
+DISCARD_LIMITS_SCRIPT='q=/sys/block/${1##*/}/queue; cat "$q/discard_max_bytes" "$q/discard_granularity" "$q/rotational"'
+#discovery reads them along with the serial, so the host is only asked about drives it hasn't listed
+def discard_limits(host,drive_path):
+    limits=queue_limits.get((host,drive_path))
+    if limits is None:
+        output=get_transport(host).run(['sh','-c',DISCARD_LIMITS_SCRIPT,'sh',drive_path],stdout=subprocess.PIPE,stderr=subprocess.DEVNULL)
+        limits=queue_limits[(host,drive_path)]=parse_discard_limits(output.stdout)
+    return limits
+def parse_discard_limits(text):
+    try:
+        return dict(zip(('discard_max_bytes','discard_granularity','rotational'),(int(value) for value in text.split())))
+    except ValueError:
+        return dict()
+
+#how a drive is erased: 'random' for every drive when a random pass is asked for; otherwise 'discard' for NVMe,
+#'discard-check' for SATA/SAS SSDs whose queue accepts discards, and 'native' or 'shred' as set by --erase-engine
+def erase_strategy(host,drive_path,data):
+    if erase_engine == 'random':
+        return 'random'
+    if data['device']['protocol'] == 'NVMe':
+        return 'discard'
+    if ssd_discard != 'off':
+        limits=discard_limits(host,drive_path)
+        solid_state=data.get('rotation_rate') == 0 or limits.get('rotational') == 0
+        if solid_state and limits.get('discard_max_bytes'):
+            return 'discard-check'
+    return erase_engine
+
+#feed the progress lines of a running command to progress(done,size), stopping it if cancelled is set; returns its exit code
+def follow_progress(proc,stream,parse,progress,cancelled):
+    for line in io.TextIOWrapper(stream,errors='replace'):
+        if cancelled is not None and cancelled.is_set():
+            proc.terminate()
+            break
+        parsed=parse(line)
+        if parsed and progress:
+            progress(int(parsed[0]),parsed[1] and int(parsed[1]))
+    return proc.wait()
+
+#discard a whole SSD discard_step bytes at a time, securely if the drive supports it, then read a sample back
+#drives that don't return zeros for discarded blocks are overwritten with zeros instead
+#returns how the drive ended up erased: 'secure discard', 'discard' or 'zero fill'; None if it wasn't
+def discard_erase(host,drive_path,progress=None,cancelled=None):
+    transport=get_transport(host)
+    method=None
+    for secure in (True,False):
+        proc=transport.popen(['blkdiscard','-v','-p',str(discard_step)]+(['-s'] if secure else [])+[drive_path],stdout=subprocess.PIPE,stderr=subprocess.PIPE)
+        returncode=follow_progress(proc,proc.stdout,parse_discard_progress,progress,cancelled)
+        errors=proc.stderr.read().decode('utf-8',errors='replace').strip()
+        proc.stderr.close()
+        if cancelled is not None and cancelled.is_set():
+            return None
+        if returncode == 0:
+            method='secure discard' if secure else 'discard'
+            break
+        print(f'{"Secure discard" if secure else "Discard"} of {drive_path} on {transport} failed: {errors}')
+    if method:
+        regions,nonzero_bytes,confidence=verify_sampled(drive_path,transport,discard_check_samples,cancelled=cancelled)
+        if cancelled is not None and cancelled.is_set():
+            return None
+        if not nonzero_bytes:
+            print(f'{drive_path} on {transport}: {method} reads back as zeros at the head, tail and {discard_check_samples} random ranges')
+            return method
+        print(f'{drive_path} on {transport} does not read back zeros after {method} ({len(regions)} non-zero regions sampled), overwriting it instead')
+    if host:
+        proc=transport.popen(['sh','-c',REMOTE_ZERO_FILL_SCRIPT,'sh',drive_path,str(erase_block_size),'0'],stderr=subprocess.PIPE)
+        if follow_progress(proc,proc.stderr,parse_dd_progress,progress,cancelled) != 0:
+            return None
+    else:
+        zero_fill(drive_path,erase_block_size,progress=progress,cancelled=cancelled)
+    return 'zero fill'
+
+#initiate drive erasure the way erase_strategy() picked for it
 #returns handle to subprocess, which we can poll later to check for exit code to know when it's done
-def erase_drive(drive_path,device_type):
+#progress is an JobProgress that is kept up to date while the erase runs; a resumed erase starts at progress.offset
+#seed is the random pattern's, for 'random'
+def erase_drive(host,drive_path,strategy,progress,seed=None):
     if drive_path != None:
-        if device_type == 'NVMe':
-            return subprocess.Popen((['ssh',f'{login}'] if login else [])+['blkdiscard','-q','-s','-f',drive_path])
+        if strategy == 'random':
+            if host:
+                return popen_with_progress(host,['sh','-c',REMOTE_PATTERN_FILL_SCRIPT,'sh',drive_path,str(erase_block_size),str(progress.offset),pattern_key(seed),pattern_iv(progress.offset)],'stderr',parse_dd_progress,progress)
+            return EngineJob(f'Random pattern erase of {drive_path}',pattern_fill,drive_path,seed,erase_block_size,progress.offset,progress.mark_synced,tracker=progress)
+        elif strategy in ('discard','discard-check'):
+            #discarding is quick, so an interrupted one simply starts over
+            progress.offset=progress.done=0
+            if strategy == 'discard-check':
+                return EngineJob(f'Discard of {drive_path} on {get_transport(host)}',discard_erase,host,drive_path,tracker=progress,failed=lambda result: result is None)
+            return popen_with_progress(host,['blkdiscard','-q','-v','-p','1G','-s','-f',drive_path],'stdout',parse_discard_progress,progress)
             #return subprocess.Popen(['sleep','5'])
+        #shred can't start part way into a drive; its zero pass is finished by the native engine, which writes the same zeros
+        elif strategy == 'native' or progress.offset:
+            if host:
+                return popen_with_progress(host,['sh','-c',REMOTE_ZERO_FILL_SCRIPT,'sh',drive_path,str(erase_block_size),str(progress.offset)],'stderr',parse_dd_progress,progress)
+            return EngineJob(f'Native erase of {drive_path}',zero_fill,drive_path,erase_block_size,progress.offset,progress.mark_synced,tracker=progress)
         else:
-            return subprocess.Popen((['ssh',f'{login}'] if login else [])+['shred','-n','0','-z',drive_path])
+            return popen_with_progress(host,['shred','-v','-n','0','-z',drive_path],'stderr',parse_shred_progress,progress)
             #return subprocess.Popen(['sleep','5'])
 
+#record a finished erase on its drive; runs on the GUI thread
+def finish_erase(serial,exitcode):
+    print(f'erase of {serial} exited with {exitcode}')
+    #the command can exit before its last progress line is read
+    job=jobs.get(serial,'erase')
+    reader=getattr(job and job.handle,'progress_reader',None)
+    if reader is not None:
+        reader.join(2)
+    if exitcode == 0:
+        all_drives[serial].erased=True
+        journal.record(all_drives[serial],erased=True,erase_offset=None)
+    else:
+        checkpoint_erase(serial)
+    progress=erase_progress.pop(serial,None)
+    #a short erase may not have printed any progress at all, and one that succeeded has been over the whole drive
+    if progress and exitcode == 0 and progress.size:
+        progress.update(max(progress.done,progress.size))
+    if progress:
+        print(f'{serial}: {humanize.naturalsize(progress.done)} in {datetime.timedelta(seconds=int(time.monotonic()-progress.start))}, average {humanize.naturalsize(progress.average_rate())}/s')
+    smart_cache.invalidate(serial)
+    jobs.transition(serial,'erase','done' if exitcode == 0 else 'cancelled' if exitcode == -signal.SIGTERM else 'failed',result=exitcode)
+
+#sysfs device path of each drive, e.g. /sys/devices/pci0000:00/0000:00:17.0/ata3/host2/target2:0:0/2:0:0:0/block/sda
+#discovery already reads them, so the host is only asked about paths it hasn't listed
+def get_topology(host,drive_paths):
+    if simulated_topology:
+        return {drive_path:simulated_topology.get(drive_path,'') for drive_path in drive_paths}
+    missing=[drive_path for drive_path in drive_paths if (host,drive_path) not in sysfs_paths]
+    if missing:
+        try:
+            output=get_transport(host).run(['sh','-c','for dev; do echo "$dev $(readlink -f /sys/block/${dev##*/})"; done','sh']+missing,stdout=subprocess.PIPE,check=True)
+        except subprocess.CalledProcessError as e:
+            print('Subprocess for get_topology() failed:')
+            print(e)
+        else:
+            for line in output.stdout.decode('utf-8').splitlines():
+                if ' ' in line:
+                    drive_path,sysfs_path=line.split(' ',1)
+                    sysfs_paths[(host,drive_path)]=sysfs_path
+    return {drive_path:sysfs_paths.get((host,drive_path),'') for drive_path in drive_paths}
+
+#the link a drive shares with others: the USB hub or SAS expander it sits behind, otherwise its PCI controller
+def controller_group(sysfs_path):
+    parts=sysfs_path.split('/')
+    key=None
+    for i,part in enumerate(parts):
+        if re.fullmatch(r'[0-9a-f]{4}:[0-9a-f]{2}:[0-9a-f]{2}\.[0-7]',part) or part.startswith('expander-') or re.fullmatch(r'usb\d+',part):
+            key=i
+    #USB ports look like 2-1 or 2-1.3; the drive's hub is the port above its own
+    usb_ports=[i for i,part in enumerate(parts) if re.fullmatch(r'\d+-[\d.]+',part)]
+    if len(usb_ports) >= 2:
+        key=usb_ports[-2]
+    return '/'.join(parts[:key+1]) if key is not None else 'unknown'
+
+#erases behind one shared link, with a concurrency limit adapted to the group's total throughput
+class ControllerGroup:
+    def __init__(self,key):
+        self.key=key
+        self.limit=group_start_limit
+        self.ceiling=group_max_limit
+        self.running=set()
+        self.queue=collections.deque()
+        #best total rate seen at each limit
+        self.rates=dict()
+        #whether the last adapt() raised the limit, leaving the step to be judged
+        self.raised=False
+        self.last_change=time.monotonic()
+    def total_rate(self):
+        return sum(progress.current_rate() for progress in (erase_progress.get(serial) for serial in list(self.running)) if progress is not None)
+    #hill climb: while drives are waiting, try one more erase at a time and keep it only if the total speed goes up
+    #each step is judged once, on the first full interval after it; the dips as one drive finishes and the next starts
+    #would otherwise walk the limit back down a step at a time
+    def adapt(self):
+        now=time.monotonic()
+        if now-self.last_change < group_adapt_interval or len(self.running) < self.limit:
+            return
+        rate=self.total_rate()
+        self.rates[self.limit]=max(rate,self.rates.get(self.limit,0))
+        previous=self.rates.get(self.limit-1)
+        raised,self.raised=self.raised,False
+        if raised and rate < previous*(1+group_min_gain):
+            #the last step didn't pay off; go back and stop probing above it
+            self.ceiling=self.limit-1
+            self.limit-=1
+            print(f'{self.key}: {humanize.naturalsize(rate)}/s is no better than {humanize.naturalsize(previous)}/s, limit back to {self.limit}')
+        elif self.queue and self.limit < self.ceiling:
+            self.limit+=1
+            self.raised=True
+            print(f'{self.key}: {humanize.naturalsize(rate)}/s with {len(self.running)} erases, trying {self.limit}')
+        self.last_change=now
+
+#starts erases only as fast as each controller group can take them
+#start(serial) is called, from whichever thread freed the slot, when a submitted erase may begin; call finished() when it ends
+class EraseScheduler:
+    def __init__(self):
+        self.groups=dict()
+        self.group_of=dict()
+        self.lock=threading.Lock()
+    def submit(self,serial,host,drive_path,start):
+        key=controller_group(get_topology(host,[drive_path]).get(drive_path,''))
+        #controllers on different hosts share nothing
+        if host:
+            key=f'{host}:{key}'
+        with self.lock:
+            group=self.groups.setdefault(key,ControllerGroup(key))
+            self.group_of[serial]=group
+            group.queue.append((serial,start))
+        self.dispatch(group)
+    def finished(self,serial):
+        with self.lock:
+            group=self.group_of.pop(serial,None)
+            if group is None:
+                return
+            group.running.discard(serial)
+            group.queue=collections.deque(item for item in group.queue if item[0] != serial)
+        self.dispatch(group)
+    def dispatch(self,group):
+        starting=list()
+        with self.lock:
+            while group.queue and len(group.running) < group.limit:
+                serial,start=group.queue.popleft()
+                group.running.add(serial)
+                starting.append((serial,start))
+        for serial,start in starting:
+            start(serial)
+    #call periodically while erases are running
+    def tick(self):
+        for group in list(self.groups.values()):
+            with self.lock:
+                group.adapt()
+            self.dispatch(group)
+
+erase_scheduler=EraseScheduler()
+
+#adaptive erase concurrency against the throttled stand-in shred (fixtures/throttle.py): count image files spread over
+#groups controllers, each controller sharing bandwidth between its erases and losing contention of it for every erase
+#past the first. every controller's limit should climb while a step adds throughput and back off from the first one
+#that doesn't; returns whether they all settled on the limit the model allows
+def bench_erase_scheduler(count,groups,size_mib,drive_rate=100e6,bandwidth=400e6,contention=0.05):
+    global group_adapt_interval
+    #the model's total rate with n erases running, and the limit hill climbing should end on
+    def total(n):
+        return min(n*drive_rate,bandwidth/(1+contention*(n-1)))
+    expected=group_start_limit
+    while expected < group_max_limit and total(expected+1) >= total(expected)*(1+group_min_gain):
+        expected+=1
+    #seconds rather than minutes, so the climb fits in a short run
+    JobProgress.window=3
+    group_adapt_interval=4
+    fake_bin=os.path.join(os.path.dirname(os.path.abspath(__file__)),'fixtures','bin')
+    os.environ['PATH']=fake_bin+os.pathsep+os.environ['PATH']
+    with tempfile.TemporaryDirectory(prefix='shredmeister-bench-') as directory:
+        os.environ['FAKE_THROTTLE']=directory
+        paths=[os.path.join(directory,f'disk{i:04}.img') for i in range(count)]
+        for i,path in enumerate(paths):
+            simulated_topology[path]=f'/sys/devices/pci0000:00/0000:00:1f.{i%groups}/ata{i+1}/host{i}/target{i}:0:0/{i}:0:0:0/block/sd{i}'
+            with open(path,'wb') as f:
+                f.truncate(size_mib*1024*1024)
+        with open(os.path.join(directory,'groups.json'),'w') as f:
+            json.dump({path:controller_group(simulated_topology[path]) for path in paths},f)
+        with open(os.path.join(directory,'limits.json'),'w') as f:
+            json.dump({'drive_rate':drive_rate,'bandwidth':bandwidth,'contention':contention},f)
+        print(f'{count} drives of {humanize.naturalsize(size_mib*1024*1024)} behind {groups} controllers; each drive {humanize.naturalsize(drive_rate)}/s, '
+            f'each controller {humanize.naturalsize(bandwidth)}/s less {contention:.0%} per extra erase; best limit {expected}, '
+            f'{humanize.naturalsize(total(expected))}/s')
+        procs=dict()
+        def start(serial):
+            progress=erase_progress[serial]=JobProgress(size_mib*1024*1024)
+            procs[serial]=popen_with_progress(None,['shred','-v','-n','0','-z',serial],'stderr',parse_shred_progress,progress)
+        begin=time.monotonic()
+        for path in paths:
+            erase_scheduler.submit(path,None,path,start)
+        timeline=collections.defaultdict(list)
+        while procs:
+            for serial,proc in list(procs.items()):
+                if proc.poll() is not None:
+                    proc.progress_reader.join(2)
+                    del procs[serial]
+                    erase_progress.pop(serial,None)
+                    erase_scheduler.finished(serial)
+            erase_scheduler.tick()
+            for key,group in erase_scheduler.groups.items():
+                if not timeline[key] or timeline[key][-1][1] != group.limit:
+                    timeline[key].append((time.monotonic()-begin,group.limit))
+            time.sleep(0.25)
+        elapsed=time.monotonic()-begin
+    passed=True
+    for key,group in erase_scheduler.groups.items():
+        rates=', '.join(f'{limit}: {humanize.naturalsize(rate)}/s' for limit,rate in sorted(group.rates.items()))
+        print(f'{key}: limit {" -> ".join(f"{limit} at {at:.0f} s" for at,limit in timeline[key])}; best rate at each limit {rates}')
+        passed=passed and group.limit == expected and group.ceiling == expected
+    print(f'{humanize.naturalsize(count*size_mib*1024*1024)} erased in {elapsed:.0f} s; '+('every controller settled on the best limit' if passed else f'not every controller settled on limit {expected}'))
+    return passed
+
+#returns sha256 and length of a file's contents
+def hash_file(path):
+    digest=hashlib.sha256()
+    length=0
+    with open(path,'rb') as f:
+        while chunk := f.read(erase_block_size):
+            digest.update(chunk)
+            length+=len(chunk)
+    return digest.hexdigest(),length
+
+#time shred against the native zero fill on a loop device or image file, and check both leave identical contents
+#the target is filled with random data before each run; an image of size_mib is created if no target is given
+def bench_erase(target,size_mib):
+    if target is None:
+        target=os.path.join(tempfile.gettempdir(),f'shredmeister-bench-{os.getpid()}.img')
+        with open(target,'wb') as f:
+            f.truncate(size_mib*1024*1024)
+        created=True
+    else:
+        created=False
+    results=dict()
+    try:
+        for engine in ('shred','native'):
+            with open(target,'r+b') as f:
+                size=f.seek(0,os.SEEK_END)
+                f.seek(0)
+                while f.tell() < size:
+                    f.write(os.urandom(min(erase_block_size,size-f.tell())))
+                os.fsync(f.fileno())
+            start=time.perf_counter()
+            if engine == 'shred':
+                subprocess.run(['shred','-n','0','-z',target],check=True)
+            else:
+                zero_fill(target)
+            elapsed=time.perf_counter()-start
+            results[engine]=hash_file(target)
+            print(f'{engine}: {humanize.naturalsize(size)} in {elapsed:.2f} s, {humanize.naturalsize(size/elapsed)}/s')
+    finally:
+        if created:
+            os.remove(target)
+    print('results identical' if results['shred'] == results['native'] else f'results differ: {results}')
+
+#time the random pattern generator on its own, with and without prefetching, and the comparison verification does, so they
+#can be checked against disk speeds; then write and verify the pattern on an image file, check a damaged sector is found,
+#and check the stream regenerated from an offset matches the stream from the start
+def bench_pattern(size_mib):
+    size=size_mib*1024*1024
+    seed=new_pattern_seed()
+    buffer=bytearray(verify_block_size)
+    with PatternStream(seed) as stream:
+        start=time.perf_counter()
+        for offset in range(0,size,len(buffer)):
+            stream.read_into(memoryview(buffer)[:min(len(buffer),size-offset)])
+        elapsed=time.perf_counter()-start
+    print(f'generator: {humanize.naturalsize(size)} in {elapsed:.2f} s, {humanize.naturalsize(size/elapsed)}/s')
+    with PatternStream(seed) as stream:
+        start=time.perf_counter()
+        for offset,expected,length in prefetch(lambda view,offset: stream.read_into(view),[bytearray(verify_block_size) for i in range(2)],0,size):
+            pass
+        elapsed=time.perf_counter()-start
+    print(f'generator, prefetched: {humanize.naturalsize(size)} in {elapsed:.2f} s, {humanize.naturalsize(size/elapsed)}/s')
+    copy=memoryview(bytearray(buffer))
+    start=time.perf_counter()
+    for offset in range(0,size,len(buffer)):
+        find_mismatch(copy,offset,list(),buffer)
+    elapsed=time.perf_counter()-start
+    print(f'comparison: {humanize.naturalsize(size)} in {elapsed:.2f} s, {humanize.naturalsize(size/elapsed)}/s')
+    target=os.path.join(tempfile.gettempdir(),f'shredmeister-bench-{os.getpid()}.img')
+    with open(target,'wb') as f:
+        f.truncate(size)
+    try:
+        start=time.perf_counter()
+        pattern_fill(target,seed)
+        elapsed=time.perf_counter()-start
+        print(f'pattern fill: {humanize.naturalsize(size)} in {elapsed:.2f} s, {humanize.naturalsize(size/elapsed)}/s')
+        start=time.perf_counter()
+        regions,mismatched,confidence=verify_pattern(target,get_transport(None),seed)
+        elapsed=time.perf_counter()-start
+        passed=not mismatched
+        print(f'pattern verify: {humanize.naturalsize(size)} in {elapsed:.2f} s, {humanize.naturalsize(size/elapsed)}/s, {"passed" if passed else f"{mismatched} bytes differ"}')
+        damaged=size//2+12345
+        with open(target,'r+b') as f:
+            f.seek(damaged)
+            byte=f.read(1)
+            f.seek(damaged)
+            f.write(bytes([byte[0]^1]))
+        regions,mismatched,confidence=verify_pattern(target,get_transport(None),seed)
+        found=regions == [(damaged-damaged % VERIFY_SECTOR,VERIFY_SECTOR)]
+        print(f'damaged sector {"found" if found else f"not found: {regions}"}')
+    finally:
+        os.remove(target)
+    offset=size//3-size//3 % 16
+    whole=bytearray(offset+4096)
+    part=bytearray(4096)
+    with PatternStream(seed) as stream:
+        stream.read_into(memoryview(whole))
+    with PatternStream(seed,offset) as stream:
+        stream.read_into(memoryview(part))
+    matches=whole[offset:] == part
+    print('stream from an offset matches' if matches else 'stream from an offset differs')
+    return passed and found and matches
+
 #display popup with hexdump printout of first few LBA of drive
-def hexdump(drive_path):
+def hexdump(host,drive_path):
     try:
-        output=subprocess.run((['ssh',f'{login}'] if login else [])+['hexdump','-C','-n17408',drive_path],stdout=subprocess.PIPE)
+        output=get_transport(host).run(['hexdump','-C','-n17408',drive_path],stdout=subprocess.PIPE)
     except:
         pass
     else:
-        sg.popup_scrolled(output.stdout.decode('utf-8'),title=f'{drive_path} LBA Check',font="Monospace 8")
-
-#callback functions for marking drives as tested after timer subprocess completion
-def mark_short_tested(serial):
-    all_drives[serial].short_tested=True
-    for item in timer_list_short:
-        if serial in item:
-            timer_list_short.remove(item)
-    window.write_event_value('-RefreshPage-',1)
-def mark_long_tested(serial):
-    all_drives[serial].long_tested=True
-    for item in timer_list_extended:
-        if serial in item:
-            timer_list_extended.remove(item)
-    window.write_event_value('-RefreshPage-',1)
-
-#initiate conveyance tests; runs a timer that expires at the estimated completion time
-#after timer expires, callback functions are run to mark drives as tested
-def short_test(serial,drive_path,eta):
-    if drive_path != None:
-        proc_status=subprocess.Popen((['ssh',f'{login}'] if login else [])+["smartctl","-q","silent","-t","short",drive_path])
-        t = threading.Timer(eta,mark_short_tested,args=(serial,))
-        t.start()
-        return t
-def long_test(serial,drive_path,eta):
+        sg.popup_scrolled(output.stdout.decode('utf-8'),title=f'{drive_path} on {get_transport(host)} LBA Check',font="Monospace 8")
+
+#runs smartctl with the given options on several drives of the host at once, in one invocation
+#returns "{path}"->parsed JSON, or None for drives where smartctl failed
+BATCH_SMARTCTL_SCRIPT=r'''
+options=$1
+shift
+tmp=$(mktemp -d) || exit 1
+i=0
+for dev; do
+    (smartctl $options "$dev" > "$tmp/$i.json"; echo $? > "$tmp/$i.rc") &
+    i=$((i+1))
+done
+wait
+i=0
+for dev; do
+    echo "#smart $dev $(cat "$tmp/$i.rc")"
+    cat "$tmp/$i.json"
+    i=$((i+1))
+done
+rm -rf "$tmp"
+'''
+def batch_smartctl(host,drive_paths,options):
+    results=dict()
+    try:
+        output=get_transport(host).run(['sh','-c',BATCH_SMARTCTL_SCRIPT,'sh',' '.join(options)]+list(drive_paths),stdout=subprocess.PIPE,check=True)
+    except subprocess.CalledProcessError as e:
+        print('Subprocess for batch_smartctl() failed:')
+        print(e)
+        return results
+    path=None
+    for line in output.stdout.decode('utf-8',errors='replace').splitlines():
+        if line.startswith('#smart '):
+            _,path,returncode=line.split(' ')
+            results[path]=[int(returncode)]
+        elif path:
+            results[path].append(line)
+    for path,(returncode,*lines) in results.items():
+        results[path]=load_smart(path,returncode,'\n'.join(lines))
+    return results
+
+#parse smartctl JSON output, or print why not and return None
+def load_smart(drive_path,returncode,text):
+    #check if bit 1 or 2 of the return code is set (command line did not parse or drive not found)
+    try:
+        if returncode & 3:
+            raise ValueError(f'smartctl returned {returncode}')
+        return json.loads(text)
+    except ValueError as e:
+        print(f'smartctl for {drive_path} failed:')
+        print(e)
+
+#a running short or extended self-test, updated from the drive's self-test execution status and log
+class SelfTest:
+    def __init__(self,serial,host,drive_path,kind,estimate,baseline):
+        self.serial=serial
+        self.host=host
+        self.drive_path=drive_path
+        self.kind=kind
+        #drive's estimate of the test duration in seconds
+        self.estimate=estimate
+        #newest self-test log entry before the test was started, to tell a finished test from the previous one
+        self.baseline=baseline
+        self.start=time.monotonic()
+        self.remaining=100
+        self.running_seen=False
+        self.finished=False
+        self.done=threading.Event()
+        self.passed=None
+        self.result=None
+    def __str__(self):
+        return f'{self.remaining}% left'
+    #block until the monitor sees the test finish
+    def wait(self,timeout=None):
+        self.done.wait(timeout)
+        return self.finished
+    #update from smartctl -c -l selftest JSON; returns True once the test has finished
+    #a drive that stops answering, or never shows the test, is given up on well after the test should have finished
+    def update(self,data):
+        expired=time.monotonic()-self.start > 2*self.estimate+600
+        try:
+            status=data['ata_smart_data']['self_test']['status']
+        except (TypeError,KeyError):
+            if expired:
+                self.finished=True
+                self.result='no self-test data'
+            return self.finished
+        try:
+            newest=data['ata_smart_self_test_log']['standard']['table'][0]
+        except (KeyError,IndexError):
+            newest=None
+        #upper nibble 0xf means a test is in progress, lower nibble is tens of percent left
+        if status['value']>>4 == 0xf:
+            self.running_seen=True
+            self.remaining=status.get('remaining_percent',(status['value'] & 0xf)*10)
+            return False
+        if self.running_seen or newest != self.baseline:
+            self.finished=True
+            self.remaining=0
+            self.passed=status.get('passed',status['value']>>4 == 0)
+            self.result=status.get('string','')
+        elif expired:
+            self.finished=True
+            self.result='Test did not start or was not recorded'
+        return self.finished
+    #poll often when the test should be close to finishing, rarely when it has hours to go
+    def poll_interval(self):
+        return min(max(self.estimate*self.remaining/100/4,5),60)
+    #stop watching the test; wait() then returns False
+    def cancel(self):
+        self_test_monitor.remove(self.serial)
+        self.done.set()
+
+#polls every drive under test with one batched smartctl call per host, at the shortest interval any of them wants
+#on_done(test) is called from the monitor thread when a test finishes; on_update() after every poll
+class SelfTestMonitor:
+    def __init__(self,on_done,on_update=None):
+        self.on_done=on_done
+        self.on_update=on_update
+        self.tests=dict()
+        self.lock=threading.Lock()
+        self.wakeup=threading.Event()
+        self.running=True
+        self.thread=threading.Thread(target=self.run,daemon=True)
+        self.thread.start()
+    def add(self,test):
+        with self.lock:
+            self.tests[test.serial]=test
+        self.wakeup.set()
+    def remove(self,serial):
+        with self.lock:
+            self.tests.pop(serial,None)
+    def run(self):
+        #first poll shortly after a test starts, to see it running
+        interval=None
+        while self.running:
+            self.wakeup.wait(interval)
+            self.wakeup.clear()
+            with self.lock:
+                tests=list(self.tests.values())
+            if not tests:
+                interval=None
+                continue
+            results=dict()
+            for host in {test.host for test in tests}:
+                results[host]=batch_smartctl(host,[test.drive_path for test in tests if test.host == host],['-j','-c','-l','selftest'])
+            for test in tests:
+                if test.update(results[test.host].get(test.drive_path)):
+                    self.remove(test.serial)
+                    self.on_done(test)
+                    test.done.set()
+            if self.on_update:
+                self.on_update()
+            with self.lock:
+                interval=min([test.poll_interval() for test in self.tests.values()],default=None)
+    def stop(self):
+        self.running=False
+        self.wakeup.set()
+
+#record a finished self-test on its drive; runs on the GUI thread
+def mark_short_tested(test):
+    all_drives[test.serial].short_tested=True
+    all_drives[test.serial].short_test_result=test.result
+    all_drives[test.serial].short_test_passed=test.passed
+    journal.record(all_drives[test.serial],short_tested=True,short_test_passed=test.passed,short_test_result=test.result)
+    smart_cache.invalidate(test.serial)
+    jobs.transition(test.serial,'short','done' if test.passed else 'failed',result=test.result)
+def mark_long_tested(test):
+    all_drives[test.serial].long_tested=True
+    all_drives[test.serial].long_test_result=test.result
+    all_drives[test.serial].long_test_passed=test.passed
+    journal.record(all_drives[test.serial],long_tested=True,long_test_passed=test.passed,long_test_result=test.result)
+    smart_cache.invalidate(test.serial)
+    jobs.transition(test.serial,'long','done' if test.passed else 'failed',result=test.result)
+
+#newest entry of a drive's self-test log, or None
+def newest_self_test(host,drive_path):
+    data=batch_smartctl(host,[drive_path],['-j','-l','selftest']).get(drive_path)
+    try:
+        return data['ata_smart_self_test_log']['standard']['table'][0]
+    except (TypeError,KeyError,IndexError):
+        return None
+
+#initiate conveyance tests; the self-test monitor watches the drive until it reports the test finished
+#eta is the drive's estimate of the test duration in seconds
+#queued is for a job start_self_test_async() already queued: the test is only started if that job is still waiting, and
+#aborted again if it was cancelled meanwhile
+def start_self_test(serial,host,drive_path,kind,eta,queued=False):
     if drive_path != None:
-        proc_status=subprocess.Popen((['ssh',f'{login}'] if login else [])+["smartctl","-q","silent","-t","long",drive_path])
-        t = threading.Timer(eta,mark_long_tested,args=(serial,))
-        t.start()
-        return t
-
-#helper function to check if something exists in a sublist of a list
-def is_in_sublist(thing,biglist):
-    for list_ in biglist:
-        if thing in list_:
-            return True
-    return False
+        if queued and getattr(jobs.get(serial,kind),'state',None) != 'queued':
+            return None
+        test=SelfTest(serial,host,drive_path,kind,eta,newest_self_test(host,drive_path))
+        get_transport(host).run(["smartctl","-q","silent","-t",kind,drive_path])
+        if not queued:
+            jobs.add(serial,kind,'running',test)
+        elif jobs.transition(serial,kind,'running',handle=test) is None:
+            get_transport(host).run(["smartctl","-q","silent","-X",drive_path])
+            return None
+        self_test_monitor.add(test)
+        return test
+def short_test(serial,host,drive_path,eta):
+    return start_self_test(serial,host,drive_path,'short',eta)
+def long_test(serial,host,drive_path,eta):
+    return start_self_test(serial,host,drive_path,'long',eta)
+
+#start a self-test from the GUI: reading the self-test log and starting the test are two smartctl round trips, so they run
+#on the SMART loader's threads, with the job queued meanwhile so a second click does nothing
+def start_self_test_async(serial,kind,eta):
+    drive=all_drives[serial]
+    jobs.add(serial,kind)
+    smart_loader.submit(start_self_test_job,serial,drive.host,str(drive.path),kind,eta)
+def start_self_test_job(serial,host,drive_path,kind,eta):
+    try:
+        start_self_test(serial,host,drive_path,kind,eta,queued=True)
+    except OSError as e:
+        print(f'Unable to start {kind} self-test of {serial}:')
+        print(e)
+        jobs.transition(serial,kind,'cancelled')
+
+#status line text for a finished or untested self-test
+def self_test_status(tested,passed,result):
+    if not tested:
+        return "❌"
+    if passed:
+        return "✔"
+    return f"❌ ({result})"
+
+#last values given to each element, so refresh() only touches elements whose values changed
+rendered=dict()
+def update_element(key,**kwargs):
+    if rendered.get(key) == kwargs:
+        return
+    rendered[key]=kwargs
+    window[key].update(**kwargs)
+#update a table in place, rewriting only the rows that changed; a full update is only needed when rows come or go
+def update_table(key,rows,row_colors=None):
+    table=window[key]
+    old=rendered.get(key)
+    if old is not None and old['row_colors'] == row_colors and len(old['values']) == len(rows) == len(table.tree_ids):
+        for i,(old_row,row) in enumerate(zip(old['values'],rows)):
+            if old_row != row:
+                table.Widget.item(table.tree_ids[i],values=row)
+                table.Values[i]=row
+    elif old is None or old['values'] != rows or old['row_colors'] != row_colors:
+        if row_colors is None:
+            table.update(values=rows)
+        else:
+            table.update(values=rows,row_colors=row_colors)
+    rendered[key]={'values':rows,'row_colors':row_colors}
 
 #refresh the displayed data for the tab of the specified drive, given its smart data
+#the buttons follow the selected tab, so they are only updated when serial is the one shown
+#the tab is drawn from cached data; unless use_stale_data, data older than --smart-max-age is read again on the SMART
+#loader's threads and the tab redrawn when it arrives, so the GUI thread never waits on smartctl
+@profiled
 def refresh(serial,use_stale_data=False):
-    print(f'refreshing {serial}')
+    current=window['Tabgroup'].get() == serial
     if serial == 'main_tab':
-        window[f'-Erase-'].update(disabled=True)
-        window[f'-Short-'].update(disabled=True)
-        window[f'-Long-'].update(disabled=True)
-        window[f'-SMART-'].update(disabled=True)
-        window[f'-HEX-'].update(disabled=True)
-        window[f'-main-tab-table-'].update(values=[(
-            [serial,drive.path,drive.short_tested,drive.long_tested,drive.erased]) for serial,drive in all_drives.items()
-        ])
+        for button in ('-Erase-','-Verify-','-Surface-','-Quick-','-Short-','-Long-','-SMART-','-HEX-'):
+            update_element(button,disabled=True)
+        update_table('-main-tab-table-',main_tab_rows(host_filter))
         #printout='Drives:\n'
         #window[f'-main-tab-text-'].update(value=f'{printout}')
-    #hide tab and remove any running timers
+    #hide tab
     elif all_drives[serial].removed:
-        window[f'{serial}'].update(visible=False)
-        #I don't like how this is iterated, but should be fine since there should be only one timer per type of test per drive...
-        for i in range(len(timer_list_short)):
-            if timer_list_short[i][0] == serial:
-                timer_list_short[i][1].cancel()
-                del timer_list_short[i]
-        for i in range(len(timer_list_short)):
-            if timer_list_short[i][0] == serial:
-                timer_list_short[i][1].cancel()
-                del timer_list_short[i]
-                
+        update_element(f'{serial}',visible=False)
     else:
-        window[f'{serial}'].update(visible=True)
-        window[f'-SMART-'].update(disabled=False)
-        window[f'-HEX-'].update(disabled=False)
-        if use_stale_data:
-            data=smart_data_dict[serial]
-        else:
-            data=smart_data_dict[serial]=json.loads(get_smart(all_drives[serial].path))
-        device_model=data['model_name']
+        update_element(f'{serial}',visible=True)
+        data=smart_cache.peek(serial)
+        if not use_stale_data and smart_cache.stale(serial):
+            load_smart_async(serial)
+        #if there is no data yet, show the tab without it and let the loader fill it in
+        if data is None:
+            load_smart_async(serial)
+            update_element(f'{serial} model',value='SMART read failed' if smart_cache.failed_recently(serial) else model_text(None))
+            if current:
+                for button in ('-Erase-','-Verify-','-Surface-','-Quick-','-Short-','-Long-'):
+                    update_element(button,disabled=True)
+            return
         device_protocol=data['device']['protocol']
-        drive_bytes=data['user_capacity']['bytes']
-        drive_capacity=humanize.naturalsize(int( 0 if drive_bytes is None else drive_bytes))
         table_data,new_row_colors=make_table_data(serial,data)
-        erasing=is_in_sublist(serial,subproc_list)
-        erased="..." if erasing else "✔" if all_drives[serial].erased else "❌"
-        if erasing or all_drives[serial].mounted:
-            window[f'-Erase-'].update(disabled=True)
-        else:
-            window[f'-Erase-'].update(disabled=False)
-        short_tested="..." if is_in_sublist(serial,timer_list_short) else "✔" if all_drives[serial].short_tested else "❌"
-        long_tested="..." if is_in_sublist(serial,timer_list_extended) else "✔" if all_drives[serial].long_tested else "❌"
-        window[f'{serial} status'].update(value=f'Erased: {erased} Short: {short_tested} Extended: {long_tested}')
-        if device_protocol == 'NVMe':
-            window[f'{serial} model'].update(value=f'{device_model} {device_protocol} {drive_capacity}')
-            window[f'-Short-'].update(disabled=True)
-            window[f'-Long-'].update(disabled=True)
-        else:
+        erasing=jobs.active(serial,'erase')
+        wiping=jobs.active(serial,'quick')
+        checkpoint=journal.state(serial)
+        erased=f"... {erase_progress[serial]}" if serial in erase_progress else "... queued" if erasing else "... quick wipe" if wiping else "✔" if all_drives[serial].erased else f"❌ (interrupted at {checkpoint['erase_offset']/checkpoint['erase_size']:.1%}, Erase resumes)" if checkpoint.get('erase_offset') and checkpoint.get('erase_size') and journal.checkpoint_fresh(checkpoint) else "❌ (quick-wiped, needs a full erase)" if all_drives[serial].quick_wiped else "❌"
+        verifying=jobs.active(serial,'verify')
+        surfacing=jobs.active(serial,'surface')
+        surface=f"... {surface_progress[serial]}" if serial in surface_progress else surface_summary(all_drives[serial].surface_scan)
+        verified=f"... {verify_progress[serial]}" if serial in verify_progress else "❌" if not all_drives[serial].verified else "✔" if all_drives[serial].verify_confidence == 1 else f"✔ ({all_drives[serial].verify_confidence:.1%} sampled)"
+        if current:
+            update_element('-SMART-',disabled=False)
+            update_element('-HEX-',disabled=False)
+            update_element('-Erase-',disabled=bool(erasing or verifying or surfacing or wiping or all_drives[serial].mounted))
+            update_element('-Verify-',disabled=bool(erasing or verifying or wiping))
+            update_element('-Surface-',disabled=bool(erasing or surfacing or wiping))
+            update_element('-Quick-',disabled=bool(erasing or verifying or surfacing or wiping or all_drives[serial].mounted))
+            update_element('-Short-',disabled=device_protocol == 'NVMe')
+            update_element('-Long-',disabled=device_protocol == 'NVMe')
+        short_tested=f"... {jobs.get(serial,'short').handle or 'starting'}" if jobs.active(serial,'short') else self_test_status(all_drives[serial].short_tested,all_drives[serial].short_test_passed,all_drives[serial].short_test_result)
+        long_tested=f"... {jobs.get(serial,'long').handle or 'starting'}" if jobs.active(serial,'long') else self_test_status(all_drives[serial].long_tested,all_drives[serial].long_test_passed,all_drives[serial].long_test_result)
+        update_element(f'{serial} status',value=f'Erased: {erased} Verified: {verified} Short: {short_tested} Extended: {long_tested}')
+        update_element(f'{serial} surface',value=f'Surface: {surface}\n{surface_details(all_drives[serial].surface_scan)}'.rstrip())
+        update_element(f'{serial} history',value=smart_changes_text(all_drives[serial]))
+        update_element(f'{serial} model',value=model_text(data))
+        update_element(f'{serial} sn',value=f'S/N: {all_drives[serial].serial}')
+        update_table(f'{serial} table',table_data,new_row_colors)
+
+#drives whose display is out of date; background threads mark them with request_refresh() and the GUI thread
+#redraws them all in one -RefreshDrives- event, so a burst of completions costs one redraw per drive
+refresh_coalesce=0.1
+refresh_pending=set()
+refresh_lock=threading.Lock()
+#when the oldest pending refresh was asked for; the wait until it is drawn is recorded as refresh_delay_seconds
+refresh_requested=None
+def request_refresh(serial):
+    global refresh_requested
+    with refresh_lock:
+        scheduled=bool(refresh_pending)
+        refresh_pending.add(serial)
+        if not scheduled:
+            refresh_requested=time.perf_counter()
+    if not scheduled:
+        threading.Timer(refresh_coalesce,window.write_event_value,('-RefreshDrives-',1)).start()
+def take_refreshes():
+    with refresh_lock:
+        pending=set(refresh_pending)
+        refresh_pending.clear()
+        if pending:
+            metrics.observe('refresh_delay_seconds',time.perf_counter()-refresh_requested)
+            metrics.observe('refresh_batch_drives',len(pending))
+    return pending
+
+#which SMART fields and attributes are shown, how they are formatted and what colours their values get; --rules
+smart_rules_path=os.path.join(os.path.dirname(os.path.abspath(__file__)),'smart_rules.json')
+smart_rules=None
+
+#value formats a rule can name
+RULE_FORMATS={
+    'plain':lambda value: value,
+    'bytes':lambda value: humanize.naturalsize(value),
+    'hours':lambda value: humanize.naturalsize(int(value))[:-1]+' hours',
+    'celsius':lambda value: f'{value}°C',
+}
+
+#a rule's "path" is a dotted path into the smartctl JSON, or a list of them to try in turn, each optionally {"path":...,"scale":...}
+#returns a function that gets the value from a document, raising KeyError if none of the paths is there
+def compile_getter(spec,scale=1):
+    candidates=list()
+    for candidate in spec if isinstance(spec,list) else [spec]:
+        if isinstance(candidate,str):
+            candidate={'path':candidate}
+        candidates.append((tuple(candidate['path'].split('.')),candidate.get('scale',1)*scale))
+    def get(data):
+        for keys,candidate_scale in candidates:
+            value=data
             try:
-                rpm=data['rotation_rate']
-            except KeyError as e:
-                rpm='?'
-            window[f'{serial} model'].update(value=f'{device_model} {device_protocol} {drive_capacity} {rpm} RPM')
-            window[f'-Short-'].update(disabled=False)
-            window[f'-Long-'].update(disabled=False)
-        window[f'{serial} sn'].update(value=f'S/N: {serial}')
-        window[f'{serial} table'].update(values=table_data[:][:],row_colors=new_row_colors)
-    window.refresh()
+                for key in keys:
+                    value=value[key]
+            except (KeyError,TypeError):
+                continue
+            return value*candidate_scale if candidate_scale != 1 and value is not None else value
+        raise KeyError('/'.join('.'.join(keys) for keys,_ in candidates))
+    return get
 
-#populate data table for specified drive, given its smart data
-def make_table_data(drive,data):
-    try:
-        smart_passed=''
-        try:
-            smart_passed=data['smart_status']['passed']
-        except KeyError as e:
-            smart_passed='n/a'
-        device_protocol=data['device']['protocol']
-        my_row_colors = []
-        if(device_protocol == 'NVMe'):
-            table_data=[
-                ["SMART Passed", smart_passed ],
-                ["Available Spare", data['nvme_smart_health_information_log']['available_spare'] ],
-                ["Power Cycles", data['nvme_smart_health_information_log']['power_cycles'] ],
-                ["Hours", humanize.naturalsize(data['nvme_smart_health_information_log']['power_on_hours'])[:-1]+' hours' ],
-                ["Unsafe Shutdowns", data['nvme_smart_health_information_log']['unsafe_shutdowns'] ],
-                ["Data Read", humanize.naturalsize(data['nvme_smart_health_information_log']['data_units_read']*512000)],
-                ["Data Written", humanize.naturalsize(data['nvme_smart_health_information_log']['data_units_written']*512000) ],
-                ["Media Errors", data['nvme_smart_health_information_log']['media_errors'] ]
-            ]
-            
-            if(table_data[0][1]==True):
-                my_row_colors.append([0,"black","green"])
-            else:
-                my_row_colors.append([0,"black","red"])
-            
-            if(table_data[1][1]<80):
-                my_row_colors.append([1,"black","yellow"])
-            elif(table_data[1][1]<50):
-                my_row_colors.append([1,"black","red"])
-            else:
-                my_row_colors.append([1,"black","green"])
+#"colors" is a list of {"below":x|"above":x|"equals":x,"color":c}, the first that matches wins; one without a test always matches
+#returns a function from a value to a colour, or None
+def compile_colors(colors):
+    tests=list()
+    for rule in colors:
+        if 'below' in rule:
+            tests.append((lambda value,limit=rule['below']: value < limit,rule['color']))
+        elif 'above' in rule:
+            tests.append((lambda value,limit=rule['above']: value > limit,rule['color']))
+        elif 'equals' in rule:
+            tests.append((lambda value,expected=rule['equals']: value == expected,rule['color']))
         else:
-            power_on_hours=None
+            tests.append((lambda value: True,rule['color']))
+    def color(value):
+        for test,color in tests:
             try:
-                my_hours=data['power_on_time']['hours']
-            except KeyError as e:
-                try:
-                    my_hours=data['power_on_time']['seconds']
-                except KeyError as e:
-                    pass
-                else:
-                    power_on_hours=int(my_hours/3600)
-            else:
-                power_on_hours=int(my_hours)
+                if test(value):
+                    return color
+            except TypeError:
+                #a placeholder such as 'n/a' where a number was expected
+                continue
+    return color
+
+#one table row: (label,get,format,color,default)
+def compile_row(rule,getter):
+    fmt=RULE_FORMATS[rule.get('format','plain')]
+    return (rule['label'],getter,fmt,compile_colors(rule.get('colors',[])) if rule.get('colors') else None,rule.get('default'))
+
+#turn the rules file's contents into what make_table_data() runs: per protocol, the field rows in order,
+#and for ATA a dispatch table from attribute ID to its row, so a drive's attribute table is read in one pass
+def compile_rules(rules):
+    compiled=dict()
+    for protocol,section in rules.items():
+        fields=[compile_row(rule,compile_getter(rule['path'],rule.get('scale',1))) for rule in section.get('fields',[])]
+        attributes=dict()
+        for attribute_id,rule in section.get('attributes',{}).items():
+            key=('value',) if rule.get('value') == 'normalized' else ('raw','value')
+            scale=rule.get('scale',1)
+            mask=rule.get('mask')
+            def get(row,key=key,scale=scale,mask=mask):
+                value=row[key[0]] if len(key) == 1 else row[key[0]][key[1]]
+                if mask is not None:
+                    value&=mask
+                return value*scale if scale != 1 else value
+            attributes[int(attribute_id)]=compile_row(rule,get)
+        compiled[protocol.lower()]=(fields,attributes)
+    return compiled
+
+def load_rules(path):
+    with open(path) as f:
+        return compile_rules(json.load(f))
+
+#SMART values kept over time for every drive, as (name,label,source,watched): source is an ATA attribute ID, whose raw
+#value is taken, or a dotted path (or list of paths, the first present wins) into the smartctl JSON. watched values are
+#reported when a job changes them
+#these overlap smart_rules.json but are deliberately not taken from it: the rules only say what a tab shows and can be
+#swapped with --rules, while snapshots are delta encoded by field position, so the history needs a list that doesn't
+#change or lose fields under the snapshots already kept
+SNAPSHOT_FIELDS=(
+    ('reallocated','Reallocated sectors',5,True),
+    ('pending','Pending sectors',197,True),
+    ('offline_uncorrectable','Offline uncorrectable',198,True),
+    ('reported_uncorrectable','Reported uncorrectable',187,True),
+    ('crc_errors','CRC errors',199,True),
+    ('media_errors','Media errors','nvme_smart_health_information_log.media_errors',True),
+    ('critical_warning','Critical warning','nvme_smart_health_information_log.critical_warning',True),
+    ('available_spare','Available spare','nvme_smart_health_information_log.available_spare',True),
+    ('percentage_used','Percentage used','nvme_smart_health_information_log.percentage_used',True),
+    ('error_log_entries','Error log entries','nvme_smart_health_information_log.num_err_log_entries',True),
+    ('power_on_hours','Power on hours',['power_on_time.hours','nvme_smart_health_information_log.power_on_hours'],False),
+    ('temperature','Temperature','temperature.current',False),
+)
+SNAPSHOT_GETTERS=[None if isinstance(source,int) else compile_getter(source) for name,label,source,watched in SNAPSHOT_FIELDS]
 
-            ata_smart_passed=None
+#the SNAPSHOT_FIELDS values of a smartctl document, in order, None for the ones it doesn't have
+def snapshot_values(data):
+    attributes={attribute['id']:attribute['raw']['value'] for attribute in data.get('ata_smart_attributes',{}).get('table',[]) if 'raw' in attribute}
+    values=list()
+    for (name,label,source,watched),get in zip(SNAPSHOT_FIELDS,SNAPSHOT_GETTERS):
+        if get is None:
+            value=attributes.get(source)
+        else:
             try:
-                ata_smart_passed=data['ata_smart_data']['self_test']['status']['passed']
-            except KeyError as e:
-                ata_smart_passed='N/A'
-
-            table_data=[
-                ["Smart Passed", ata_smart_passed ],
-                ["Smart Status", data['ata_smart_data']['self_test']['status']['string'] ],
-                ["Power On Time", humanize.naturalsize(power_on_hours)[:-1]+' hours' ],
-                ["Power Cycle Count", data['power_cycle_count'] ],
-            ]
-            #set the colour of certain rows depending on value, to highlight good and bad attributes
-            if(table_data[0][1]==True):
-                my_row_colors.append([0,"black","green"])
-            else:
-                my_row_colors.append([0,"black","red"])
-            if(power_on_hours<10000):
-                my_row_colors.append([2,"black","green"])
-            elif(power_on_hours<20000):
-                my_row_colors.append([2,"black","yellow"])
-            else:
-                my_row_colors.append([2,"black","red"])
-            
-            for row in data['ata_smart_attributes']['table']:
-                match(row['id']):
-                    case 5:
-                        val=row['raw']['value']
-                        table_data.append(["RAS",val])
-                        index=len(table_data)-1
-                        if(val>0):
-                            my_row_colors.append([index,"black","red"])
-                        else:
-                            my_row_colors.append([index,"black","green"])
-                    case 197:
-                        val=row['raw']['value']
-                        table_data.append(["Pending",val])
-                        index=len(table_data)-1
-                        if(val>0):
-                            my_row_colors.append([index,"black","red"])
-                        else:
-                            my_row_colors.append([index,"black","green"])
-                    case 191:
-                        val=row['raw']['value']
-                        table_data.append(["GSENSE",val])
-                        index=len(table_data)-1
-                        if(val>0):
-                            my_row_colors.append([index,"black","red"])
-                        else:
-                            my_row_colors.append([index,"black","green"])
-                    case 241:
-                        val=row['raw']['value']
-                        table_data.append(["Data Written",humanize.naturalsize(val*512)])
-                    case 242:
-                        val=row['raw']['value']
-                        table_data.append(["Data Read",humanize.naturalsize(val*512)])
-                    case 194:
-                        val=row['flags']['value']
-                        table_data.append(["Temperature",f'{val}°C'])
-                    case 12:
-                        val=row['flags']['value']
-                        table_data.append(["Power Cycles",f'{val}'])
-        return table_data,my_row_colors
-    except KeyError as e:
-        print(f'KeyError in make_data_table() for {drive}: {e}')
+                value=get(data)
+            except KeyError:
+                value=None
+        values.append(int(value) if isinstance(value,(int,float)) else None)
+    return values
+
+#zigzag varints: numbers close to zero, positive or negative, take a single byte
+def put_varint(out,value):
+    value=value*2 if value >= 0 else -value*2-1
+    if value < 0x80:
+        out.append(value)
+        return
+    while value >= 0x80:
+        out.append(value&0x7f|0x80)
+        value>>=7
+    out.append(value)
+def get_varint(data,pos):
+    value=data[pos]
+    if value < 0x80:
+        return (-(value>>1)-1 if value&1 else value>>1),pos+1
+    value=0
+    shift=0
+    while True:
+        byte=data[pos]
+        pos+=1
+        value|=(byte&0x7f)<<shift
+        if byte < 0x80:
+            break
+        shift+=7
+    return (-(value>>1)-1 if value&1 else value>>1),pos
+
+#one drive's snapshots, packed into a bytearray: each is an event code, the seconds since the one before and the change of each
+#of the drive's fields, all as varints. SMART counters rarely move, so most snapshots take a few bytes
+#fields are the indexes into SNAPSHOT_FIELDS the drive has; last holds their newest values so appending needs no decoding, and
+#marks the values as each kind of job last started, so what a job changed needs no decoding either
+class SmartSeries:
+    __slots__=('fields','start','last_time','last','data','count','marks')
+    def __init__(self,fields,start):
+        self.fields=fields
+        self.start=start
+        self.last_time=start
+        self.last=array.array('q',[0]*len(fields))
+        self.data=bytearray()
+        self.count=0
+        self.marks=dict()
+    def append(self,code,now,values):
+        put_varint(self.data,code)
+        put_varint(self.data,now-self.last_time)
+        for j,value in enumerate(values):
+            put_varint(self.data,value-self.last[j])
+            self.last[j]=value
+        self.last_time=now
+        self.count+=1
+    #(time,code,values) of every snapshot, oldest first
+    def decode(self):
+        snapshots=list()
+        pos=0
+        now=self.start
+        values=[0]*len(self.fields)
+        while pos < len(self.data):
+            code,pos=get_varint(self.data,pos)
+            delta,pos=get_varint(self.data,pos)
+            now+=delta
+            for j in range(len(values)):
+                delta,pos=get_varint(self.data,pos)
+                values[j]+=delta
+            snapshots.append((now,code,list(values)))
+        return snapshots
+
+#SMART snapshot history of every drive, keyed by drive key; at most max_snapshots are kept per drive, the oldest half being
+#dropped when there are more, so memory stays bounded however long the station runs
+#subscribers are called as callback(key,event) for every snapshot taken at a job's start or end
+class SmartHistory:
+    def __init__(self,max_snapshots=256):
+        self.max_snapshots=max_snapshots
+        self.series=dict()
+        self.events=['read']
+        self.codes={'read':0}
+        self.lock=threading.Lock()
+        self.subscribers=list()
+    def __str__(self):
+        with self.lock:
+            return f'SMART history: {len(self.series)} drives, {sum(series.count for series in self.series.values())} snapshots, {sum(len(series.data) for series in self.series.values())} bytes'
+    def subscribe(self,callback):
+        self.subscribers.append(callback)
+    #add a snapshot of a smartctl document; event is 'read' for data read for any other reason, which is only kept if
+    #something changed, or '{job kind} start' or '{job kind} end'. a job event without data repeats the newest values
+    def record(self,key,data,event='read',now=None):
+        return self.record_values(key,snapshot_values(data),event,now)
+    def record_values(self,key,values,event='read',now=None):
+        fields=tuple(i for i,value in enumerate(values) if value is not None)
+        now=int(time.time() if now is None else now)
+        with self.lock:
+            series=self.series.get(key)
+            if not fields and (series is None or event == 'read'):
+                return False
+            if series is None:
+                series=self.series[key]=SmartSeries(fields,now)
+            #a drive that starts reporting more fields starts a new series, carrying the newest values and job starts over
+            elif fields != series.fields and not set(fields) <= set(series.fields):
+                old=series
+                series=self.series[key]=SmartSeries(tuple(sorted(set(fields)|set(old.fields))),now)
+                carried=dict(zip(old.fields,old.last))
+                values=[carried.get(i) if value is None else value for i,value in enumerate(values)]
+                for kind,mark in old.marks.items():
+                    marked=dict(zip(old.fields,mark))
+                    series.marks[kind]=array.array('q',[marked.get(i,values[i]) for i in series.fields])
+            current=[series.last[j] if values[i] is None else values[i] for j,i in enumerate(series.fields)]
+            if event == 'read' and series.count and current == list(series.last):
+                return False
+            code=self.codes.get(event)
+            if code is None:
+                code=self.codes[event]=len(self.events)
+                self.events.append(event)
+            series.append(code,now,current)
+            if event.endswith(' start'):
+                series.marks[event[:-len(' start')]]=array.array('q',current)
+            if series.count > self.max_snapshots:
+                self.trim(key,series)
+        if event != 'read':
+            for callback in self.subscribers:
+                callback(key,event)
+        return True
+    def trim(self,key,series):
+        kept=series.decode()[-self.max_snapshots//2:]
+        trimmed=self.series[key]=SmartSeries(series.fields,kept[0][0])
+        trimmed.marks=series.marks
+        for now,code,values in kept:
+            trimmed.append(code,now,values)
+    def count(self,key):
+        with self.lock:
+            series=self.series.get(key)
+            return series.count if series else 0
+    #every snapshot of a drive, oldest first, as (time,event,{name:value})
+    def snapshots(self,key):
+        with self.lock:
+            series=self.series.get(key)
+            if series is None:
+                return []
+            names=[SNAPSHOT_FIELDS[i][0] for i in series.fields]
+            return [(now,self.events[code],dict(zip(names,values))) for now,code,values in series.decode()]
+    #drop the start of a drive's last job of this kind, before a new one is taken
+    def forget_start(self,key,kind):
+        with self.lock:
+            series=self.series.get(key)
+            if series is not None:
+                series.marks.pop(kind,None)
+    #watched values that differ between the newest snapshot and the start of the drive's last job of this kind, as
+    #[(label,before,after)]; None if the job's start wasn't recorded. the end snapshot is read after the next job may have
+    #started, which is why starts are kept per kind
+    def job_changes(self,key,kind):
+        with self.lock:
+            series=self.series.get(key)
+            before=series and series.marks.get(kind)
+            if before is None:
+                return None
+            return [(SNAPSHOT_FIELDS[i][1],before[j],series.last[j]) for j,i in enumerate(series.fields) if SNAPSHOT_FIELDS[i][3] and before[j] != series.last[j]]
+
+smart_history=SmartHistory()
+
+#record snapshots of n simulated drives, seeded from the smartctl documents in fixtures, reporting the recording rate, the
+#memory the history takes and how long one drive's history takes to look up
+def bench_history(n,fixtures,snapshots=100):
+    bases=[snapshot_values(json.load(open(os.path.join(fixtures,name)))) for name in sorted(os.listdir(fixtures)) if name.endswith('.json')]
+    history=SmartHistory()
+    keys=[f'sim{i}' for i in range(n)]
+    rng=random.Random(0)
+    drives=[list(bases[i%len(bases)]) for i in range(n)]
+    grown=set()
+    start=time.perf_counter()
+    for snapshot in range(snapshots):
+        now=1700000000+snapshot*600
+        #every drive is read once per round; hours tick over, temperatures wander and now and then one grows a bad sector
+        for key,values in zip(keys,drives):
+            if values[10] is not None:
+                values[10]+=snapshot%6 == 0
+            if values[11] is not None:
+                values[11]=35+rng.randrange(8)
+            if values[0] is not None and rng.random() < 0.001:
+                values[0]+=rng.randrange(1,9)
+                grown.add(key)
+            history.record_values(key,values,'erase start' if snapshot == snapshots-2 else 'erase end' if snapshot == snapshots-1 else 'read',now)
+    elapsed=time.perf_counter()-start
+    recorded=sum(series.count for series in history.series.values())
+    #everything the history holds: the table, the keys and every series with its packed snapshots and last values
+    memory=sys.getsizeof(history.series)+sum(sys.getsizeof(key)+sys.getsizeof(series)+sys.getsizeof(series.fields)+sys.getsizeof(series.data)+sys.getsizeof(series.last) for key,series in history.series.items())
+    print(f'{n} drives x {snapshots} reads in {elapsed:.2f} s ({n*snapshots/elapsed:.0f}/s), {recorded} snapshots kept')
+    print(f'memory: {humanize.naturalsize(memory,binary=True)} ({memory/n:.0f} bytes per drive, {memory/recorded:.1f} per snapshot)')
+    sample=rng.sample(keys,min(n,1000))
+    start=time.perf_counter()
+    for key in sample:
+        history.snapshots(key)
+    lookup=(time.perf_counter()-start)/len(sample)
+    start=time.perf_counter()
+    changed={key for key in keys if history.job_changes(key,'erase')}
+    scan=time.perf_counter()-start
+    print(f'one drive\'s history: {lookup*1e6:.0f} µs; changes during the last job of every drive: {scan:.2f} s')
+    #only a sector grown between the last two rounds counts as changed during the job
+    ok=all(len(history.snapshots(key)) <= history.max_snapshots for key in keys) and changed <= grown
+    print(f'{len(changed)} drives changed during the last job; {"consistent" if ok else "INCONSISTENT"}')
+    return ok
+
+#evaluate one row; returns the shown value and its colour, or None if the value isn't there and the rule has no default
+def evaluate_row(row_rule,source):
+    label,get,fmt,color,default=row_rule
+    try:
+        value=get(source)
+    except KeyError:
+        if default is None:
+            return None
+        return default,color and color(default)
+    return fmt(value),color and color(value)
+
+#populate data table for specified drive, given its smart data, following the compiled rules
+@profiled
+def make_table_data(drive,data):
+    global smart_rules
+    if smart_rules is None:
+        smart_rules=load_rules(smart_rules_path)
+    try:
+        fields,attributes=smart_rules.get(data['device']['protocol'].lower(),([],{}))
+    except (KeyError,AttributeError) as e:
+        print(f'No device protocol in SMART data for {drive}: {e}')
         return [],[]
+    table_data=list()
+    my_row_colors=list()
+    for row_rule in fields:
+        row=evaluate_row(row_rule,data)
+        if row is not None:
+            if row[1]:
+                my_row_colors.append([len(table_data),"black",row[1]])
+            table_data.append([row_rule[0],row[0]])
+    if attributes:
+        for attribute in data.get('ata_smart_attributes',{}).get('table',[]):
+            row_rule=attributes.get(attribute['id'])
+            if row_rule is None:
+                continue
+            row=evaluate_row(row_rule,attribute)
+            if row is not None:
+                if row[1]:
+                    my_row_colors.append([len(table_data),"black",row[1]])
+                table_data.append([row_rule[0],row[0]])
+    return table_data,my_row_colors
 
-#make table for main tab to display list of all drives and their status
-def main_tab_table():
-    table_header=["S/N","Path","Short","Long","Erased"]
-    table_data=[
-        ([serial,drive.path,drive.short_tested,drive.long_tested,drive.erased]) for serial,drive in all_drives.items()
+#time make_table_data() over the smartctl JSON documents in a directory, each evaluated many times
+def bench_rules(directory,count=20000):
+    global smart_rules
+    documents=list()
+    for name in sorted(os.listdir(directory)):
+        if name.endswith('.json'):
+            with open(os.path.join(directory,name)) as f:
+                documents.append(json.load(f))
+    if not documents:
+        print(f'No .json fixtures in {directory}')
+        return
+    start=time.perf_counter()
+    rules=load_rules(smart_rules_path)
+    print(f'rules compiled in {(time.perf_counter()-start)*1000:.2f} ms')
+    smart_rules=rules
+    for document in documents:
+        table_data,row_colors=make_table_data('fixture',document)
+        print(f'{document.get("model_name","?")}: {len(table_data)} rows, {len(row_colors)} coloured')
+    start=time.perf_counter()
+    for i in range(count):
+        make_table_data('fixture',documents[i % len(documents)])
+    elapsed=time.perf_counter()-start
+    print(f'{count} documents in {elapsed:.2f} s: {count/elapsed:.0f} documents/s, {elapsed/count*1e6:.1f} µs each')
+
+#make table for main tab to display list of all drives and their status, grouped by host
+#host_filter limits it to the drives of one host ('' or None for all hosts)
+@profiled
+def main_tab_rows(host_filter=None):
+    return [
+        ([str(get_transport(drive.host)),drive.serial,drive.path,drive.short_tested,drive.long_tested,'quick' if drive.quick_wiped and not drive.erased else drive.erased,drive.verified,str(erase_progress[key]) if key in erase_progress else str(verify_progress[key]) if key in verify_progress else '']) for key,drive in sorted(all_drives.items(),key=lambda item: (item[1].host or '',item[1].serial)) if not host_filter or str(get_transport(drive.host)) == host_filter
     ]
+def main_tab_table():
+    table_header=["Host","S/N","Path","Short","Long","Erased","Verified","Progress"]
+    table_data=main_tab_rows()
     return sg.Table(
         values=table_data[:][:],
         headings=table_header,
         justification='left',
+        #sized up front, as the table starts out empty and fills in as drives are found
+        auto_size_columns=False,
+        col_widths=[16,20,10,6,6,7,8,36],
         key=f'-main-tab-table-'
     )
 
-#create data table for given drive
+#create data table for given drive; empty until its smart data is in
 def make_table(drive,data):
     table_header=["Attribute", "Value"]
-    table_data, my_row_colors = make_table_data(drive,data)
+    table_data, my_row_colors = make_table_data(drive,data) if data is not None else ([],[])
     return sg.Table(
         values=table_data[:][:],
         headings=table_header,
         justification='left',
         row_colors=my_row_colors,
+        auto_size_columns=False,
+        col_widths=[18,24],
         key=f'{drive} table'
     )
     
@@ -382,97 +2802,126 @@ def main_tab():
         [
             [
                 #sg.Text(f'Main Tab',key='-main-tab-text-'),
+                sg.Text('Host:'),
+                sg.Combo(['']+[str(get_transport(host)) for host in hosts],default_value='',readonly=True,enable_events=True,key='-HostFilter-'),
+                sg.Button('Erase Quick-Wiped',key='-EraseQuickWiped-'),
+            ],
+            [
                 main_tab_table(),
             ]
         ],
         key=f'main_tab'
     )
 
-#create new tab for a drive  
-def new_tab(serial):
-    data=smart_data_dict[serial]=json.loads(get_smart(all_drives[serial].path))
+#model line of a drive's tab
+def model_text(data):
+    if data is None:
+        return 'Reading SMART data...'
     device_model=data['model_name']
     device_protocol=data['device']['protocol']
     drive_bytes=data['user_capacity']['bytes']
     drive_capacity=humanize.naturalsize(int( 0 if drive_bytes is None else drive_bytes))
-    erased="✔" if all_drives[serial].erased else "❌"
-    short_tested="✔" if all_drives[serial].short_tested else "❌"
-    long_tested="✔" if all_drives[serial].long_tested else "❌"
-    if(device_protocol == 'NVMe'):
-        return sg.Tab(
-            f'{serial}',
+    if device_protocol == 'NVMe':
+        return f'{device_model} {device_protocol} {drive_capacity}'
+    try:
+        rpm=data['rotation_rate']
+    except KeyError as e:
+        rpm='?'
+    return f'{device_model} {device_protocol} {drive_capacity} {rpm} RPM'
+
+#create new tab for a drive, from whatever smart data is already cached; refresh() fills in the rest
+def new_tab(serial):
+    drive=all_drives[serial]
+    data=smart_cache.peek(serial)
+    #remote drives are titled with their host, so drives on different machines can be told apart
+    title=f'{drive.host}: {drive.serial}' if drive.host else drive.serial
+    erased="✔" if drive.erased else "❌"
+    verified="✔" if drive.verified else "❌"
+    short_tested="✔" if drive.short_tested else "❌"
+    long_tested="✔" if drive.long_tested else "❌"
+    return sg.Tab(
+        title,
+        [
             [
-                [
-                    sg.Text(f'{device_model} {device_protocol} {drive_capacity}',key=f'{serial} model'),
-                ],
-                [
-                    sg.Text(f'S/N: {serial}',key=f'{serial} sn'),
-                ],
-                [
-                    sg.Text(f'Erased: {erased}',key=f'{serial} status'),
-                ],
-                [
-                    make_table(serial,data)
-                ]
+                sg.Text(model_text(data),key=f'{serial} model'),
+            ],
+            [
+                sg.Text(f'S/N: {drive.serial}',key=f'{serial} sn'),
+            ],
+            [
+                sg.Text(f'Erased: {erased} Verified: {verified} Short: {short_tested} Extended: {long_tested}',key=f'{serial} status'),
+            ],
+            [
+                sg.Text(f'Surface: {surface_summary(drive.surface_scan)}\n{surface_details(drive.surface_scan)}'.rstrip(),key=f'{serial} surface'),
             ],
-            key=f'{serial}'
-        )
-    else:
-        try:
-            rpm=data['rotation_rate']
-        except KeyError as e:
-            rpm='?'
-        return sg.Tab(
-            f'{serial}',
             [
-                [
-                    sg.Text(f'{device_model} {device_protocol} {drive_capacity} {rpm} RPM' ,key=f'{serial} model'),
-                ],
-                [
-                    sg.Text(f'S/N: {serial}',key=f'{serial} sn'),
-                ],
-                [
-                    sg.Text(f'Erased: {erased} Short: {short_tested} Extended: {long_tested}',key=f'{serial} status'),
-                ],
-                [
-                    make_table(serial,data)
-                ]
+                sg.Text(smart_changes_text(drive),key=f'{serial} history'),
             ],
-            key=f'{serial}'
-        )
+            [
+                make_table(serial,data)
+            ]
+        ],
+        key=f'{serial}'
+    )
 
-#detects connected storage drives, makes an object for each, adds them to dictionary
+#detects connected storage drives on every host at once, makes an object for each, adds them to dictionary
+@profiled
 def scan():
     global all_drives
-    drives=get_drives()
-    mounted_drives=get_mounted_drives()
-    if(len(drives)>0):
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(hosts)) as executor:
+        results=list(executor.map(discover,hosts))
+    for host,(drives,mounted_drives,smart_data) in zip(hosts,results):
         for serial,path in drives.items():
             mounted=False
             if serial in mounted_drives:
                 mounted = True
-            all_drives[f'{serial}']=Drive(serial,path,mounted)
-            #all_drives.append(serial,Drive(serial,path,mounted))
-            smart_data_dict[serial]=json.loads(get_smart(path))
+            key=drive_key(host,serial)
+            all_drives[key]=Drive(serial,path,mounted,host)
+            journal.restore(all_drives[key])
+            if serial in smart_data:
+                smart_cache.put(key,smart_data[serial])
+
+#all_drives key of a drive: the serial for drives on this machine, host/serial for drives behind --login
+def drive_key(host,serial):
+    return f'{host}/{serial}' if host else serial
 
 #object class to keep record of drives that have been connected
 class Drive:
-    def __init__(self,serial,path,mounted):
+    def __init__(self,serial,path,mounted,host=None):
         self.serial=serial
+        self.host=host
+        self.key=drive_key(host,serial)
         self.path=path
         self.mounted=mounted
         self.removed=False
         self.erased=False
+        self.verified=False
+        self.verify_confidence=None
+        #seed of the random pattern the drive was last erased with; None if it was zeroed
+        self.pattern_seed=None
+        #result of the last surface_scan(), None if it hasn't had one
+        self.surface_scan=None
+        #watched SMART values that changed during the drive's last job, {'job':kind,'time':...,'changes':[[label,before,after],...]}
+        self.smart_changes=None
+        #result of the last quick_wipe() that zeroed everything it meant to, None if it hasn't had one; the drive still
+        #needs a full erase
+        self.quick_wiped=None
+        self.nonzero_regions=list()
         self.short_tested=False
+        self.short_test_passed=None
+        self.short_test_result=None
         self.long_tested=False
+        self.long_test_passed=None
+        self.long_test_result=None
     def __hash__(self):
-        return hash(self.serial)
+        return hash(self.key)
     def __str__(self):
+        where=f' on {self.host}' if self.host else ''
         if self.removed:
-            return f"S/N {self.serial}, Not connected"
+            return f"S/N {self.serial}{where}, Not connected"
         if self.mounted:
-            return f"S/N {self.serial}, {self.path}, Mounted"
-        return f"S/N {self.serial}, {self.path}, Unmounted"
+            return f"S/N {self.serial}{where}, {self.path}, Mounted"
+        return f"S/N {self.serial}{where}, {self.path}, Unmounted"
     def remove(self):
         self.path=None
         self.mounted=False
@@ -482,42 +2931,736 @@ class Drive:
         self.mounted=mounted
         self.removed=False
 
-#refresh tabs, add new tabs for new drives, hide tabs for missing drives, etc
-def rescan():
-    print('rescanning drives')
-    global all_drives
-    mounted_drives=get_mounted_drives()
-    new_all_drives=get_drives()
-    #repopulate SMART data from drives that are present
-    #for drive in new_all_drives.values():
-        #if drive.removed == False:
-    #    smart_data_dict[serial]=json.loads(get_smart(path))
-    #iterate over old list of drives
-    for serial,drive in all_drives.items():
-        #mark drive as removed if not in new list of all drives
-        if serial not in new_all_drives.keys():
-            drive.remove()
+#drive results that survive a restart, as Drive attribute names
+JOURNAL_FIELDS=('erased','verified','verify_confidence','pattern_seed','surface_scan','smart_changes','quick_wiped','short_tested','short_test_passed','short_test_result','long_tested','long_test_passed','long_test_result')
+
+#append-only log of drive results and erase checkpoints, so a crash or restart loses nothing and an erase can resume
+#each line is a JSON object of the fields that changed for one drive; replaying them gives each drive's state
+#path None keeps the state in memory only (--journal off)
+class Journal:
+    def __init__(self,path):
+        self.path=path
+        self.states=dict()
+        self.lock=threading.Lock()
+        self.file=None
+        if path:
+            os.makedirs(os.path.dirname(path) or '.',exist_ok=True)
+            self.load()
+            self.compact()
+            self.file=open(path,'a')
+    def load(self):
+        try:
+            f=open(self.path)
+        except FileNotFoundError:
+            return
+        with f:
+            for line in f:
+                try:
+                    self.apply(json.loads(line))
+                except (ValueError,KeyError) as e:
+                    #the last line may have been cut short by a crash mid-write
+                    print(f'Skipping damaged journal entry in {self.path}: {e}')
+    def apply(self,entry):
+        entry=dict(entry)
+        self.states.setdefault(entry.pop('drive'),dict()).update(entry)
+    #rewrite the journal as one line per drive, so it doesn't grow without end; the old file is only replaced once the new one is on disk
+    def compact(self):
+        fd,tmp=tempfile.mkstemp(dir=os.path.dirname(self.path) or '.',prefix='.journal-')
+        with os.fdopen(fd,'w') as f:
+            for key,state in self.states.items():
+                f.write(json.dumps({'drive':key,**state})+'\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp,self.path)
+    #save fields for a drive; on disk before this returns
+    def record(self,drive,**fields):
+        entry={'drive':drive.key,'time':round(time.time(),3),'serial':drive.serial,'host':drive.host,**fields}
+        with self.lock:
+            self.apply(entry)
+            if self.file:
+                self.file.write(json.dumps(entry)+'\n')
+                self.file.flush()
+                os.fsync(self.file.fileno())
+    def state(self,key):
+        with self.lock:
+            return dict(self.states.get(key,{}))
+    #put a drive's saved results back on it
+    def restore(self,drive):
+        state=self.state(drive.key)
+        for field in JOURNAL_FIELDS:
+            if field in state:
+                setattr(drive,field,state[field])
+    #whether a drive state's erase checkpoint is recent enough to resume from; checkpoints from before they were timed aren't
+    def checkpoint_fresh(self,state):
+        return time.time()-state.get('erase_checkpointed',0) <= erase_resume_max_age
+    #where an interrupted erase of a drive of this size can pick up, or 0
+    def resume_offset(self,key,size):
+        state=self.state(key)
+        offset=state.get('erase_offset')
+        if not offset or state.get('erase_size') != size or not self.checkpoint_fresh(state):
+            return 0
+        if not state.get('erase_synced'):
+            offset=max(0,offset-erase_resume_margin)
+        #O_DIRECT writes need an aligned start
+        return offset-offset % (1024*1024)
+    #the list of processed drives as one JSON object, "{key}"->state
+    def export(self,path):
+        with self.lock:
+            states=dict(self.states)
+        with open(path,'w') as f:
+            json.dump(states,f,indent=1)
+        print(f'Exported {len(states)} drives to {path}')
+    #merge a list exported from another journal into this one
+    def import_states(self,path):
+        with open(path) as f:
+            states=json.load(f)
+        for key,state in states.items():
+            entry={'drive':key,**state}
+            with self.lock:
+                self.apply(entry)
+                if self.file:
+                    self.file.write(json.dumps(entry)+'\n')
+        if self.file:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+        print(f'Imported {len(states)} drives from {path}')
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file=None
+
+journal=Journal(None)
+
+#default journal location, under $XDG_STATE_HOME
+def default_journal_path():
+    return os.path.join(os.environ.get('XDG_STATE_HOME') or os.path.expanduser('~/.local/state'),'shredmeister','journal.jsonl')
+
+#save how far running erases have got, at most every journal_checkpoint_interval seconds each
+#the native engine's flushed offset is exact; otherwise the reported progress is saved and resume_offset() backs off from it
+journal_checkpoints=dict()
+def checkpoint_erase(serial):
+    progress=erase_progress.get(serial)
+    if progress is None or serial not in all_drives:
+        return
+    if progress.synced is not None:
+        journal.record(all_drives[serial],erase_offset=progress.synced,erase_synced=True,erase_checkpointed=round(time.time()))
+    else:
+        journal.record(all_drives[serial],erase_offset=int(progress.done),erase_synced=False,erase_checkpointed=round(time.time()))
+    journal_checkpoints[serial]=time.monotonic()
+def checkpoint_erases(force=False):
+    now=time.monotonic()
+    for serial in list(erase_progress):
+        if force or now-journal_checkpoints.get(serial,0) >= journal_checkpoint_interval:
+            checkpoint_erase(serial)
+
+#stop the erases still running and wait for them, so nothing goes on writing to a drive once the program has exited and
+#their checkpoints say where they really stopped
+def stop_erases(timeout=10):
+    handles=[job.handle for job in jobs.running('erase') if job.handle is not None]
+    for handle in handles:
+        handle.terminate()
+    deadline=time.monotonic()+timeout
+    for handle in handles:
+        try:
+            handle.wait(max(deadline-time.monotonic(),0))
+        except subprocess.TimeoutExpired:
+            handle.kill()
+            handle.wait()
+        reader=getattr(handle,'progress_reader',None)
+        if reader is not None:
+            reader.join(2)
+
+#start erasing a drive, from its checkpoint if an earlier erase of it was interrupted; data is its SMART data
+#returns the erase's process or job handle
+def start_erase(serial,data):
+    drive=all_drives[serial]
+    size=data['user_capacity']['bytes']
+    strategy=erase_strategy(drive.host,str(drive.path),data)
+    offset=journal.resume_offset(serial,size)
+    saved_seed=journal.state(serial).get('pattern_seed')
+    seed=None
+    if strategy == 'random':
+        seed=saved_seed if offset and saved_seed else pattern_seed or new_pattern_seed()
+    #a resumed erase has to carry on writing what the interrupted one was
+    if offset and seed != saved_seed:
+        offset=0
+    if offset:
+        print(f'{serial}: resuming erase at {humanize.naturalsize(offset)} of {humanize.naturalsize(size)}')
+    progress=erase_progress[serial]=JobProgress(size,offset)
+    drive.verified=False
+    drive.pattern_seed=seed
+    print(f'{serial}: erasing with {strategy}'+(f', pattern seed {seed}' if seed else ''))
+    proc=erase_drive(drive.host,str(drive.path),strategy,progress,seed)
+    jobs.transition(serial,'erase','running',handle=proc)
+    journal.record(drive,erased=False,verified=False,pattern_seed=seed,erase_offset=progress.offset,erase_size=size,erase_synced=True,erase_checkpointed=round(time.time()))
+    journal_checkpoints[serial]=time.monotonic()
+    return proc
+
+#bring the drives of one host in line with a discovery result from it: add tabs for new drives and update or hide the ones
+#that changed, leaving every other drive alone. complete=False for a result that only covers some devices (hotplug),
+#so drives missing from it are not marked as removed
+@profiled
+def apply_discovery(host,drives,mounted_drives,smart_data,complete=True):
+    changed=list()
+    if complete:
+        for key,drive in all_drives.items():
+            #mark drive as removed if not in new list of the host's drives
+            if drive.host == host and drive.serial not in drives and not drive.removed:
+                drive.remove()
+                jobs.cancel(key,('short','long','surface','quick'))
+                smart_cache.invalidate(key)
+                changed.append(key)
+    for serial,path in drives.items():
+        mounted=serial in mounted_drives
+        key=drive_key(host,serial)
+        if key in all_drives:
+            #update status of already listed drive
+            drive=all_drives[key]
+            if drive.removed or drive.path != path or drive.mounted != mounted:
+                #drive was pulled and reinserted since the last scan
+                if drive.removed or drive.path != path:
+                    smart_cache.invalidate(key)
+                drive.update(path,mounted)
+                changed.append(key)
+            if serial in smart_data:
+                smart_cache.put(key,smart_data[serial])
         else:
-        #update status of already listed drive
-            mounted=False
-            if serial in mounted_drives:
-                mounted=True
-            drive.update(new_all_drives[serial],mounted)
-        #quick refresh, without updating SMART data
-        refresh(serial,True)
-    #iterate over new list of drives
-    for serial,path in new_all_drives.items():
-        #if not in list of drives already
-        if serial not in all_drives:
-            #create new drive object
-            mounted=False
-            if serial in mounted_drives:
-                mounted=True
-            drive=Drive(serial,path,mounted)
-            all_drives[serial]=drive
-            window['Tabgroup'].add_tab(new_tab(serial))
+            #create new drive object, with whatever was done to it before a restart
+            all_drives[key]=Drive(serial,path,mounted,host)
+            journal.restore(all_drives[key])
+            if serial in smart_data:
+                smart_cache.put(key,smart_data[serial])
+            else:
+                smart_cache.invalidate(key)
+            window['Tabgroup'].add_tab(new_tab(key))
+            changed.append(key)
+    #quick refresh, without updating SMART data
+    for key in changed:
+        refresh(key,True)
+    update_table('-main-tab-table-',main_tab_rows(host_filter))
     window.refresh()
+    return changed
+
+#mark the drive at a path on a host as removed, after it was pulled
+@profiled
+def apply_removal(host,drive_path):
+    for key,drive in all_drives.items():
+        if drive.host == host and drive.path == drive_path and not drive.removed:
+            print(f'{key} removed from {drive_path}')
+            drive.remove()
+            jobs.cancel(key,('short','long','surface','quick'))
+            smart_cache.invalidate(key)
+            refresh(key,True)
+    update_table('-main-tab-table-',main_tab_rows(host_filter))
+
+#the GUI starts with no drives; this finds them in the background, each host reporting as soon as it is done
+#Refresh rescans the same way; apply_discovery() then only touches the drives that were added, removed or changed
+#on_found(host,discover() result) is called from the scanning thread
+def scan_async(on_found):
+    def scan_host(host):
+        result=discover(host,with_smart=False)
+        startup_mark(f'discovery on {get_transport(host)} ({len(result[0])} drives)')
+        on_found(host,result)
+    for host in hosts:
+        threading.Thread(target=scan_host,args=(host,),daemon=True).start()
+
+#reads SMART data for tabs shown without it, a few drives at a time, and redraws each drive as its data comes in
+#a drive whose read failed isn't asked again until the cache's backoff is over
+smart_load_workers=16
+smart_loader=concurrent.futures.ThreadPoolExecutor(max_workers=smart_load_workers)
+smart_loading=set()
+def load_smart_async(serial):
+    if serial in smart_loading or smart_cache.failed_recently(serial):
+        return
+    smart_loading.add(serial)
+    smart_loader.submit(load_smart_job,serial)
+@profiled
+def load_smart_job(serial):
+    try:
+        smart_cache.get(all_drives[serial])
+    except (TypeError,ValueError) as e:
+        print(f'Unable to read SMART data for {serial}:')
+        print(e)
+        window.write_event_value('-SmartFailed-',serial)
+        return
+    window.write_event_value('-SmartLoaded-',serial)
+
+#snapshot a drive's SMART values as each of its jobs starts and ends, to show what changed while it ran
+#the start is taken from the cached data if it is younger than --smart-max-age, otherwise the drive is read again; the end
+#always reads the drive. reads go through the SMART loader's threads so the thread that moved the job isn't held up, and
+#the end waits for its start. a job whose start couldn't be read reports no changes rather than comparing against
+#whatever was seen last
+snapshot_starts=dict()
+def snapshot_job(job,old_state):
+    if job.state == 'running' and old_state != 'running':
+        smart_history.forget_start(job.serial,job.kind)
+        data=smart_cache.peek(job.serial)
+        if data is not None and not smart_cache.stale(job.serial):
+            smart_history.record(job.serial,data,f'{job.kind} start')
+        else:
+            snapshot_starts[(job.serial,job.kind)]=smart_loader.submit(snapshot_job_start,job.serial,job.kind)
+    elif old_state == 'running':
+        smart_loader.submit(snapshot_job_end,job.serial,job.kind,snapshot_starts.pop((job.serial,job.kind),None))
+jobs.subscribe(snapshot_job)
+def snapshot_job_start(serial,kind):
+    drive=all_drives.get(serial)
+    if drive is None or drive.removed:
+        return
+    try:
+        data=smart_cache.get(drive)
+    except (TypeError,ValueError) as e:
+        print(f'Unable to read SMART data for {serial} before {kind}:')
+        print(e)
+        return
+    #a failed read hands back the old data instead
+    if not smart_cache.failed_recently(serial):
+        smart_history.record(serial,data,f'{kind} start')
+def snapshot_job_end(serial,kind,start=None):
+    if start is not None:
+        start.result()
+    drive=all_drives.get(serial)
+    if drive is None or drive.removed:
+        return
+    try:
+        data=smart_cache.get(drive,0)
+    except (TypeError,ValueError) as e:
+        print(f'Unable to read SMART data for {serial} after {kind}:')
+        print(e)
+        return
+    smart_history.record(serial,data,f'{kind} end')
+    changes=smart_history.job_changes(serial,kind)
+    if changes is None:
+        return
+    drive.smart_changes={'job':kind,'time':round(time.time()),'changes':changes}
+    journal.record(drive,smart_changes=drive.smart_changes)
+    if changes:
+        print(f'{serial}: SMART values changed during {kind}: '+', '.join(f'{label} {before} → {after}' for label,before,after in changes))
+
+#one line about what the drive's last job did to its watched SMART values
+def smart_changes_text(drive):
+    if not drive.smart_changes:
+        return f'SMART history: {smart_history.count(drive.key)} snapshots'
+    changes=drive.smart_changes['changes']
+    if not changes:
+        return f"SMART history: no changes during {drive.smart_changes['job']}"
+    return f"SMART history: ⚠ changed during {drive.smart_changes['job']}: "+', '.join(f'{label} {before} → {after}' for label,before,after in changes)
+
+#time to each point of startup, as (phase,seconds since start); printed with --startup-timing
+startup_start=time.monotonic()
+startup_times=list()
+def startup_mark(phase):
+    startup_times.append((phase,time.monotonic()-startup_start))
+def print_startup_timing():
+    print('startup timing:')
+    previous=0
+    for phase,at in sorted(startup_times,key=lambda item: item[1]):
+        print(f'  {at*1000:8.0f} ms  (+{(at-previous)*1000:6.0f} ms)  {phase}')
+        previous=at
+
+#values read at export time: jobs by kind and state, erase queues per controller group, work waiting for the GUI,
+#the speed of every running erase and verification, and the SMART cache
+def station_metrics():
+    with jobs.lock:
+        states=collections.Counter((job.kind,job.state) for kinds in jobs.jobs.values() for job in kinds.values())
+    for (kind,state),count in sorted(states.items()):
+        yield 'jobs','gauge',{'kind':kind,'state':state},count
+    with erase_scheduler.lock:
+        groups=[(group.key,len(group.queue),len(group.running),group.limit) for group in erase_scheduler.groups.values()]
+    for key,queued,running,limit in groups:
+        yield 'erase_group_queued','gauge',{'group':key},queued
+        yield 'erase_group_running','gauge',{'group':key},running
+        yield 'erase_group_limit','gauge',{'group':key},limit
+    yield 'refresh_pending','gauge',{},len(refresh_pending)
+    yield 'smart_loading','gauge',{},len(smart_loading)
+    for kind,progress_of in (('erase',erase_progress),('verify',verify_progress),('surface',surface_progress)):
+        for serial,progress in list(progress_of.items()):
+            yield f'{kind}_bytes_per_second','gauge',{'drive':serial},round(progress.current_rate())
+            yield f'{kind}_bytes_done','gauge',{'drive':serial},progress.done
+    yield 'smart_cache_hits_total','counter',{},smart_cache.hits
+    yield 'smart_cache_misses_total','counter',{},smart_cache.misses
+    yield 'smart_cache_shared_total','counter',{},smart_cache.shared
+    with smart_history.lock:
+        yield 'smart_history_snapshots','gauge',{},sum(series.count for series in smart_history.series.values())
+        yield 'smart_history_bytes','gauge',{},sum(len(series.data) for series in smart_history.series.values())
+    yield 'uptime_seconds','gauge',{},round(time.monotonic()-startup_start,1)
+metrics.collect(station_metrics)
+
+#how long each job waited for its turn and how long it ran, by kind and how it ended
+def observe_job(job,old_state):
+    if job.state == 'running' and old_state == 'queued':
+        metrics.observe('job_queued_seconds',job.started-job.created,kind=job.kind)
+    elif old_state == 'running':
+        metrics.observe('job_seconds',job.changed-job.started,kind=job.kind,state=job.state)
+jobs.subscribe(observe_job)
+
+#one line summary for --metrics-interval; command and GUI timings are since startup
+def metrics_line():
+    parts=['jobs '+(', '.join(f'{count} {state}' for state,count in jobs.counts.items() if count and state in JOB_ACTIVE) or 'idle')]
+    rates=[progress.current_rate() for progress in list(erase_progress.values())]
+    if rates:
+        parts.append(f'erasing {len(rates)} drives at {humanize.naturalsize(sum(rates))}/s')
+    waiting=sum(len(group.queue) for group in list(erase_scheduler.groups.values()))
+    if waiting:
+        parts.append(f'{waiting} erases waiting for their controller')
+    commands=metrics.totals('command_seconds','command')
+    if commands:
+        parts.append('commands '+', '.join(f'{name} {count}x avg {total/count*1000:.0f} ms max {peak*1000:.0f} ms' for name,(count,total,peak) in sorted(commands.items())))
+    events=metrics.totals('gui_event_seconds')
+    if events:
+        count,total,peak=events[None]
+        parts.append(f'GUI events {count}x avg {total/count*1000:.1f} ms max {peak*1000:.0f} ms')
+    return 'metrics: '+'; '.join(parts)
+
+def log_metrics(interval):
+    while True:
+        time.sleep(interval)
+        print(metrics_line())
 
+#serves the metrics at http://127.0.0.1:{--metrics-port}/metrics for a Prometheus scraper or curl
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path not in ('/','/metrics'):
+            self.send_error(404)
+            return
+        body=metrics.export().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type','text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length',str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    #scrapes every few seconds would drown out everything else
+    def log_message(self,format,*args):
+        pass
+
+#only this machine can read the endpoint; put a reverse proxy or ssh tunnel in front of it to scrape from elsewhere
+def serve_metrics(port,address='127.0.0.1'):
+    server=http.server.ThreadingHTTPServer((address,port),MetricsHandler)
+    server.daemon_threads=True
+    threading.Thread(target=server.serve_forever,daemon=True).start()
+    print(f'serving metrics at http://{address}:{server.server_port}/metrics')
+    return server
+
+#wait this long after a hotplug event for more, so a batch of inserted drives is discovered in one pass
+hotplug_settle=1
+NETLINK_KOBJECT_UEVENT=15
+
+#listens for block devices being added and removed, and reports them as deltas so only those drives are rescanned
+#one listener per host; source is 'netlink' (kernel uevents on this machine), 'udevadm' (udevadm monitor on the host, for --login),
+#or the path of a file or FIFO of events in the KEY=VALUE format of udevadm monitor --property, as a stand-in for testing
+#on_add(host,discover() result for the added devices) and on_remove(host,path) are called from the listener's thread
+class HotplugListener:
+    def __init__(self,host,source,on_add,on_remove):
+        self.host=host
+        self.source=source
+        self.on_add=on_add
+        self.on_remove=on_remove
+        self.events=queue.Queue()
+        self.proc=None
+        self.running=True
+        threading.Thread(target=self.read,daemon=True).start()
+        threading.Thread(target=self.run,daemon=True).start()
+    #whole-disk events for the kinds of drive discover() looks for
+    def wanted(self,event):
+        name=event.get('DEVNAME','').removeprefix('/dev/')
+        return event.get('SUBSYSTEM') == 'block' and event.get('DEVTYPE') == 'disk' and re.fullmatch(r'sd[a-x]+|nvme[0-9]n[0-9]',name)
+    def read(self):
+        try:
+            for event in self.source_events():
+                if self.wanted(event):
+                    self.events.put((event['ACTION'],'/dev/'+event['DEVNAME'].removeprefix('/dev/')))
+        except OSError as e:
+            print(f'Hotplug listener on {get_transport(self.host)} ({self.source}) stopped:')
+            print(e)
+    def source_events(self):
+        if self.source == 'netlink':
+            sock=socket.socket(socket.AF_NETLINK,socket.SOCK_DGRAM,NETLINK_KOBJECT_UEVENT)
+            #multicast group 1 receives the kernel's own events
+            sock.bind((0,1))
+            sock.settimeout(1)
+            while self.running:
+                try:
+                    data=sock.recv(65536)
+                except socket.timeout:
+                    continue
+                #"ACTION@DEVPATH" header, then NUL separated KEY=VALUE fields
+                yield dict(field.split('=',1) for field in data.decode('utf-8',errors='replace').split('\0')[1:] if '=' in field)
+        elif self.source == 'udevadm':
+            self.proc=get_transport(self.host).popen(['udevadm','monitor','--kernel','--subsystem-match=block','--property'],stdout=subprocess.PIPE,text=True)
+            yield from self.parse_properties(self.proc.stdout)
+        else:
+            with open(self.source) as f:
+                yield from self.parse_properties(self.follow(f))
+    #lines of a file as they are appended, like tail -f
+    def follow(self,f):
+        while self.running:
+            line=f.readline()
+            if line:
+                yield line
+            else:
+                time.sleep(0.5)
+    #events are blocks of KEY=VALUE lines separated by blank lines
+    def parse_properties(self,lines):
+        event=dict()
+        for line in lines:
+            line=line.strip()
+            if not line:
+                if event:
+                    yield event
+                event=dict()
+            elif '=' in line:
+                key,value=line.split('=',1)
+                event[key]=value
+        if event:
+            yield event
+    def run(self):
+        while self.running:
+            events=[self.events.get()]
+            time.sleep(hotplug_settle)
+            while not self.events.empty():
+                events.append(self.events.get())
+            #the last event for each device wins
+            actions=dict()
+            for action,drive_path in events:
+                actions[drive_path]=action
+            added=[drive_path for drive_path,action in actions.items() if action in ('add','change')]
+            for drive_path,action in actions.items():
+                if action == 'remove':
+                    self.on_remove(self.host,drive_path)
+            if added:
+                print(f'hotplug: discovering {added} on {get_transport(self.host)}')
+                self.on_add(self.host,discover(self.host,drive_paths=added))
+    def stop(self):
+        self.running=False
+        if self.proc:
+            self.proc.kill()
+
+#steps a --batch policy can contain; each drive runs them in the order given
+BATCH_STEPS=('short','long','surface','quick','erase','verify')
+#headless mode writes one JSON object per line here; everything else printed goes to stderr
+batch_output=sys.stdout
+batch_lock=threading.Lock()
+
+#events about one drive carry its host and serial
+def emit(event,drive=None,**fields):
+    if drive:
+        fields={'host':str(get_transport(drive.host)),'serial':drive.serial,**fields}
+    with batch_lock:
+        print(json.dumps({'time':round(time.time(),3),'event':event,**fields}),file=batch_output,flush=True)
+
+#run the policy's steps on one drive, stopping at the first one that fails; returns True if they all passed
+def batch_drive(serial,policy):
+    drive=all_drives[serial]
+    data=smart_cache.get(drive,float('inf'))
+    protocol=data['device']['protocol']
+    if drive.mounted:
+        emit('skipped',drive,reason='mounted')
+        return False
+    for step in policy:
+        if step in ('short','long') and protocol == 'NVMe':
+            emit('skipped',drive,step=step,reason='no self-tests on NVMe')
+            continue
+        emit('started',drive,step=step,path=drive.path)
+        if step == 'short':
+            test=short_test(serial,drive.host,drive.path,60*int(data['ata_smart_data']['self_test']['polling_minutes']['short'] or 0))
+            if test.wait():
+                with batch_lock:
+                    mark_short_tested(test)
+            passed,details=bool(test.passed),test.result or 'cancelled'
+        elif step == 'long':
+            test=long_test(serial,drive.host,drive.path,60*int(data['ata_smart_data']['self_test']['polling_minutes']['extended'] or 0))
+            if test.wait():
+                with batch_lock:
+                    mark_long_tested(test)
+            passed,details=bool(test.passed),test.result or 'cancelled'
+        elif step == 'erase':
+            admitted=threading.Event()
+            jobs.add(serial,'erase')
+            erase_scheduler.submit(serial,drive.host,drive.path,lambda serial: admitted.set())
+            admitted.wait()
+            proc=start_erase(serial,data)
+            exitcode=proc.wait()
+            erase_scheduler.finished(serial)
+            with batch_lock:
+                finish_erase(serial,exitcode)
+            passed,details=drive.erased,f'exit code {exitcode}'
+        elif step == 'quick':
+            job=start_quick_wipe(serial)
+            job.wait()
+            with batch_lock:
+                finish_quick_wipe(serial,job)
+            passed,details=job.returncode == 0,quick_wipe_summary(job.result)
+        elif step == 'surface':
+            surface_progress[serial]=JobProgress(None)
+            job=surface_scan_drive(drive.host,drive.path,surface_progress[serial])
+            jobs.add(serial,'surface','running',job)
+            job.wait()
+            with batch_lock:
+                finish_surface_scan(serial,job)
+            passed,details=job.returncode == 0,surface_summary(job.result)
+        elif step == 'verify':
+            verify_progress[serial]=JobProgress(None)
+            job=verify_drive(drive.host,drive.path,verify_progress[serial],verify_mode,drive.pattern_seed)
+            jobs.add(serial,'verify','running',job)
+            job.wait()
+            with batch_lock:
+                finish_verify(serial,job)
+            passed,details=drive.verified,f'{len(drive.nonzero_regions)} non-zero regions'
+        emit('finished',drive,step=step,passed=passed,details=details)
+        if not passed:
+            return False
+    return True
+
+#emits a progress line for every running erase, verification and self-test every interval seconds
+def batch_progress(interval,stop):
+    while not stop.wait(interval):
+        try:
+            check_slow_drives()
+            erase_scheduler.tick()
+            checkpoint_erases()
+            for name,progress_dict in (('erase',erase_progress),('verify',verify_progress),('surface',surface_progress)):
+                for serial,progress in list(progress_dict.items()):
+                    eta=progress.eta()
+                    emit('progress',all_drives[serial],step=name,done=progress.done,size=progress.size,percent=round(progress.percent(),2),
+                        rate=round(progress.current_rate()),average_rate=round(progress.average_rate()),eta=eta and round(eta),slow=progress.slow)
+            for job in jobs.running('short')+jobs.running('long'):
+                emit('progress',all_drives[job.serial],step=job.kind,remaining_percent=job.handle.remaining)
+        except Exception as e:
+            print(f'Batch progress failed: {e!r}')
+
+#headless mode: run the policy on every discovered drive, at most jobs drives at a time
+#returns True if every drive passed every step
+def run_batch(policy,workers,interval):
+    serials=[serial for serial,drive in all_drives.items() if not drive.removed]
+    emit('discovered',hosts=[str(get_transport(host)) for host in hosts],drives={serial:all_drives[serial].path for serial in serials},policy=policy)
+    stop=threading.Event()
+    threading.Thread(target=batch_progress,args=(interval,stop),daemon=True).start()
+    def run(serial):
+        try:
+            return batch_drive(serial,policy)
+        except (OSError,KeyError,TypeError,ValueError) as e:
+            emit('error',all_drives[serial],error=repr(e))
+            return False
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        results=dict(zip(serials,pool.map(run,serials)))
+    stop.set()
+    emit('done',passed=[serial for serial,ok in results.items() if ok],failed=[serial for serial,ok in results.items() if not ok])
+    return all(results.values())
+
+#mean, 95th percentile and worst of a list of durations in seconds, as milliseconds
+def latency_summary(times):
+    if not times:
+        return None
+    times=sorted(times)
+    return {'mean_ms':round(statistics.fmean(times)*1000,3),'p95_ms':round(times[int(0.95*(len(times)-1))]*1000,3),'max_ms':round(times[-1]*1000,3)}
+
+#run jobs on every drive at once; start(drive,progress) returns a process or EngineJob handle
+#returns the total rate and how long the slowest drive took
+def bench_jobs_throughput(start):
+    handles=list()
+    begin=time.perf_counter()
+    for key,drive in all_drives.items():
+        progress=JobProgress(smart_cache.peek(key)['user_capacity']['bytes'])
+        handles.append((drive,progress,start(drive,progress)))
+    failed=[drive.key for drive,progress,handle in handles if handle.wait() != 0]
+    elapsed=time.perf_counter()-begin
+    total=sum(smart_cache.peek(drive.key)['user_capacity']['bytes'] for drive,progress,handle in handles)
+    return {'bytes':total,'seconds':round(elapsed,3),'rate':round(total/elapsed),'failed':failed}
+
+#time the GUI side at the current drive count: building the tabs, refreshing each drive, and how long an event waits to be handled
+#needs a display; returns None if a window can't be opened
+def bench_gui(samples=50):
+    global window
+    try:
+        window=sg.Window('Shredmeister benchmark',[[sg.TabGroup([[main_tab()]],key='Tabgroup',enable_events=True)]],finalize=True)
+    except Exception as e:
+        print(f'No GUI timings: {e}')
+        return None
+    try:
+        rendered.clear()
+        begin=time.perf_counter()
+        for key in all_drives:
+            window['Tabgroup'].add_tab(new_tab(key))
+        tabs=time.perf_counter()-begin
+        refresh_times=list()
+        for key in all_drives:
+            begin=time.perf_counter()
+            refresh(key,True)
+            refresh_times.append(time.perf_counter()-begin)
+        begin=time.perf_counter()
+        refresh('main_tab')
+        main_table=time.perf_counter()-begin
+        event_times=list()
+        for i in range(samples):
+            window.write_event_value('-Bench-',time.perf_counter())
+            event,values=window.read()
+            for key in list(all_drives)[:10]:
+                request_refresh(key)
+            if all_drives:
+                refresh(next(iter(all_drives)),True)
+            event_times.append(time.perf_counter()-values[event])
+        return {'tabs_s':round(tabs,3),'refresh':latency_summary(refresh_times),'main_table_ms':round(main_table*1000,3),'event':latency_summary(event_times)}
+    finally:
+        window.close()
+
+#load test against stand-in tools: for each drive count, make that many sparse image files and time discovery, SMART queries,
+#erasing and verifying all of them at once, and the GUI if there is a display; results go out as one JSON document
+#smartctl, ssh, shred, blkdiscard, hexdump and blockdev come from fixtures/bin, put first on PATH; host runs it all through the fake ssh
+def bench_scale(counts,size_mib,template,latency=0,fail_percent=0,host=None,output=None):
+    global hosts,simulated_devices,ssh_command
+    fake_bin=os.path.join(os.path.dirname(os.path.abspath(__file__)),'fixtures','bin')
+    os.environ['PATH']=fake_bin+os.pathsep+os.environ['PATH']
+    os.environ['FAKE_SMART_TEMPLATE']=os.path.abspath(template)
+    os.environ['FAKE_LATENCY']=str(latency)
+    os.environ['FAKE_SSH_LATENCY']=str(latency)
+    os.environ['FAKE_FAIL_PERCENT']=str(fail_percent)
+    ssh_command=os.path.join(fake_bin,'ssh')
+    hosts=[host]
+    report={'time':round(time.time(),3),'host':str(get_transport(host)),'erase_engine':erase_engine,'drive_size':size_mib*1024*1024,
+        'template':os.path.basename(template),'latency':latency,'fail_percent':fail_percent,'results':list()}
+    for count in counts:
+        with tempfile.TemporaryDirectory(prefix='shredmeister-bench-') as directory:
+            simulated_devices=directory
+            for i in range(count):
+                with open(os.path.join(directory,f'disk{i:04}.img'),'wb') as f:
+                    f.truncate(size_mib*1024*1024)
+            all_drives.clear()
+            smart_cache.invalidate()
+            result={'drives':count}
+            begin=time.perf_counter()
+            scan()
+            result['scan_s']=round(time.perf_counter()-begin,3)
+            result['found']=len(all_drives)
+            begin=time.perf_counter()
+            discover(host,with_smart=False)
+            result['rescan_s']=round(time.perf_counter()-begin,3)
+            smart_times=list()
+            for key,drive in all_drives.items():
+                smart_cache.invalidate(key)
+                begin=time.perf_counter()
+                try:
+                    smart_cache.get(drive)
+                except (TypeError,ValueError):
+                    pass
+                smart_times.append(time.perf_counter()-begin)
+            result['smart_query']=latency_summary(smart_times)
+            #drives whose SMART query failed twice can't be erased; leave them out of the throughput runs
+            for key in [key for key in all_drives if smart_cache.peek(key) is None]:
+                del all_drives[key]
+            result['erase']=bench_jobs_throughput(lambda drive,progress: erase_drive(drive.host,drive.path,erase_strategy(drive.host,drive.path,smart_cache.peek(drive.key)),progress))
+            result['verify']=bench_jobs_throughput(lambda drive,progress: verify_drive(drive.host,drive.path,progress,verify_mode,drive.pattern_seed))
+            result['gui']=bench_gui()
+            print(f'{count} drives: scan {result["scan_s"]} s, erase {humanize.naturalsize(result["erase"]["rate"])}/s, verify {humanize.naturalsize(result["verify"]["rate"])}/s')
+            report['results'].append(result)
+    simulated_devices=None
+    all_drives.clear()
+    text=json.dumps(report,indent=1)
+    if output:
+        with open(output,'w') as f:
+            f.write(text+'\n')
+        print(f'Results written to {output}')
+    else:
+        print(text,file=sys.__stdout__)
+    return report
 
 parser=argparse.ArgumentParser(
     prog='ShredMeister',
@@ -527,7 +3670,90 @@ parser=argparse.ArgumentParser(
 )
 
 parser.add_argument('--login', action='append',nargs=1,metavar=('user@host'),type=str)
+parser.add_argument('--ssh-command',default='ssh',metavar='PATH',help='ssh client to use for --login hosts')
+parser.add_argument('--smart-max-age',default=60,type=float,metavar='SECONDS',help='reuse SMART data younger than this instead of querying the drive again')
+parser.add_argument('--erase-engine',choices=['shred','native','random'],default='shred',help="how to erase drives that are not NVMe; 'random' overwrites every drive with a seeded random pattern that verification checks")
+parser.add_argument('--pattern-seed',metavar='SEED',help='seed of the random pattern for --erase-engine random, to reproduce a pass; a new one for each drive by default')
+parser.add_argument('--ssd-discard',choices=['auto','off'],default='auto',help='erase SATA and SAS SSDs that support it by discarding them and checking a sample reads back as zeros')
+parser.add_argument('--slow-fraction',default=0.5,type=float,metavar='FRACTION',help='flag erases slower than this fraction of the median speed of all running erases')
+parser.add_argument('--verify-mode',choices=['full','sampled'],default='full',help='default verification mode')
+parser.add_argument('--surface-stride',default=1,type=int,metavar='N',help='surface scans read one block in every N; 1 reads the whole drive')
+parser.add_argument('--quick-wipe-size',default=8,type=int,metavar='MiB',help='quick wipes zero this much at each end of the drive and of every partition')
+parser.add_argument('--verify-samples',default=1000,type=int,metavar='N',help='number of random ranges read by sampled verification')
+parser.add_argument('--hotplug',default='auto',metavar='SOURCE',help="where to get hotplug events: 'netlink', 'udevadm', 'off', a file of udevadm monitor --property events, or 'auto' for netlink locally and udevadm with --login")
+parser.add_argument('--batch',metavar='POLICY',help=f'run headless: apply a comma separated list of steps ({",".join(BATCH_STEPS)}) to every drive, printing JSON progress lines')
+parser.add_argument('--jobs',default=8,type=int,metavar='N',help='number of drives processed at once in --batch mode')
+parser.add_argument('--progress-interval',default=10,type=float,metavar='SECONDS',help='time between progress lines in --batch mode')
+parser.add_argument('--group-limit',default=8,type=int,metavar='N',help='most erases run at once behind one controller, expander or USB hub')
+parser.add_argument('--topology',metavar='FILE',help='JSON object mapping device paths to sysfs paths, to simulate a controller topology')
+parser.add_argument('--journal',default=default_journal_path(),metavar='PATH',help="file that drive results and erase checkpoints are saved to, so they survive a restart; 'off' to keep them in memory only")
+parser.add_argument('--resume-max-age',default=24,type=float,metavar='HOURS',help='resume an interrupted erase only if it was last checkpointed this recently; older ones start over')
+parser.add_argument('--export',metavar='FILE',help='write the list of processed drives in the journal to FILE as JSON and exit')
+parser.add_argument('--import',dest='import_file',metavar='FILE',help='merge a list of processed drives written by --export into the journal')
+parser.add_argument('--startup-timing',action='store_true',help='print how long each part of startup took once every drive has been read')
+parser.add_argument('--rules',default=smart_rules_path,metavar='FILE',help='JSON file of the SMART fields and attributes to show, with their formats and colour thresholds')
+parser.add_argument('--devices',metavar='DIR',help='use the *.img files in DIR as the drives, for testing against stand-in tools')
+parser.add_argument('--metrics-port',type=int,metavar='PORT',help='serve metrics in Prometheus text format at http://127.0.0.1:PORT/metrics')
+parser.add_argument('--metrics-interval',default=0,type=float,metavar='SECONDS',help='print a line of metrics this often; 0 for never')
+parser.add_argument('--profile',metavar='FILE',help='profile the scan and refresh paths, printing the slowest functions on exit and saving the statistics to FILE')
+parser.add_argument('--bench',choices=['transport','erase','erase-scheduler','jobs','rules','scale','pattern','history'],help='run a benchmark and exit')
+parser.add_argument('--bench-target',metavar='PATH',help='loop device or image file to overwrite for --bench erase')
+parser.add_argument('--bench-jobs',default=5000,type=int,metavar='N',help='number of simulated drives for --bench jobs, each with four jobs, and --bench history')
+parser.add_argument('--bench-fixtures',default=os.path.join(os.path.dirname(os.path.abspath(__file__)),'fixtures','smart'),metavar='DIR',help='directory of smartctl JSON documents for --bench rules and --bench history')
+parser.add_argument('--bench-drives',default='1,10,100,500',metavar='N,N,...',help='drive counts for --bench scale')
+parser.add_argument('--bench-drive-size',default=4,type=int,metavar='MiB',help='size of each image file for --bench scale')
+parser.add_argument('--bench-erases',default=16,type=int,metavar='N',help='number of image files for --bench erase-scheduler, each standing in for a 2000 MiB drive')
+parser.add_argument('--bench-groups',default=2,type=int,metavar='N',help='number of controllers the drives are spread over for --bench erase-scheduler')
+parser.add_argument('--bench-template',default=os.path.join(os.path.dirname(os.path.abspath(__file__)),'fixtures','smart','ata_ssd.json'),metavar='FILE',help='smartctl output the stand-in smartctl answers with for --bench scale')
+parser.add_argument('--bench-latency',default=0,type=float,metavar='SECONDS',help='delay added to every stand-in tool call for --bench scale')
+parser.add_argument('--bench-fail',default=0,type=int,metavar='PERCENT',help='share of stand-in smartctl calls that fail for --bench scale')
+parser.add_argument('--bench-output',metavar='FILE',help='write --bench scale results to FILE instead of stdout')
+parser.add_argument('--bench-size',default=1024,type=int,metavar='MiB',help='size of the temporary image for --bench erase when no target is given, and of the pattern for --bench pattern')
 args=parser.parse_args()
+ssh_command=args.ssh_command
+if args.batch:
+    batch_policy=args.batch.split(',')
+    for step in batch_policy:
+        if step not in BATCH_STEPS:
+            parser.error(f'unknown --batch step {step}, expected one of {",".join(BATCH_STEPS)}')
+    #keep stdout for JSON lines only
+    sys.stdout=sys.stderr
+if args.bench == 'scale' and not args.bench_output:
+    #keep stdout for the JSON report only
+    sys.stdout=sys.stderr
+smart_cache.max_age=args.smart_max_age
+erase_resume_max_age=args.resume_max_age*3600
+erase_engine=args.erase_engine
+pattern_seed=args.pattern_seed
+ssd_discard=args.ssd_discard
+slow_fraction=args.slow_fraction
+verify_mode=args.verify_mode
+verify_samples=args.verify_samples
+surface_stride=args.surface_stride
+quick_wipe_size=args.quick_wipe_size
+group_max_limit=args.group_limit
+group_start_limit=min(group_start_limit,group_max_limit)
+if args.topology:
+    with open(args.topology) as f:
+        simulated_topology=json.load(f)
+simulated_devices=args.devices
+smart_rules_path=args.rules
+profile_path=args.profile
+if args.metrics_port:
+    serve_metrics(args.metrics_port)
+if args.metrics_interval:
+    threading.Thread(target=log_metrics,args=(args.metrics_interval,),daemon=True).start()
+try:
+    smart_rules=load_rules(smart_rules_path)
+except (OSError,ValueError,KeyError) as e:
+    parser.error(f'unable to load SMART rules from {smart_rules_path}: {e!r}')
+if args.journal != 'off':
+    journal=Journal(args.journal)
+if args.import_file:
+    journal.import_states(args.import_file)
+if args.export:
+    journal.export(args.export)
+    raise SystemExit
 ##print(repr(args.login[0][0]))
 #print(repr(vars(args)))
 #parser.print_help()
@@ -544,27 +3770,59 @@ for key,value in vars(args).items():
             except TypeError as e:
                 pass
 
-login=None
-#print(repr(logins))
-if logins:
-    for user in logins:
-        print(f'Forking to {user}')
-        pid=os.fork()
-        if pid > 0:
-            continue
-        else:
-            login=user
-            break
+if args.bench == 'transport':
+    bench_transport(logins if logins else [None])
+    close_transports()
+    raise SystemExit
+if args.bench == 'erase':
+    bench_erase(args.bench_target,args.bench_size)
+    raise SystemExit
+if args.bench == 'erase-scheduler':
+    raise SystemExit(0 if bench_erase_scheduler(args.bench_erases,args.bench_groups,2000) else 1)
+if args.bench == 'pattern':
+    raise SystemExit(0 if bench_pattern(args.bench_size) else 1)
+if args.bench == 'rules':
+    bench_rules(args.bench_fixtures)
+    raise SystemExit
+if args.bench == 'jobs':
+    raise SystemExit(0 if bench_jobs(args.bench_jobs) else 1)
+if args.bench == 'history':
+    raise SystemExit(0 if bench_history(args.bench_jobs,args.bench_fixtures) else 1)
+if args.bench == 'scale':
+    #remote when given a --login: everything then goes through the stand-in ssh
+    host_filter=''
+    bench_scale([int(count) for count in args.bench_drives.split(',')],args.bench_drive_size,args.bench_template,args.bench_latency,args.bench_fail,logins[0] if logins else None,args.bench_output)
+    close_transports()
+    print_profile()
+    raise SystemExit
+
+#this machine first, then every --login host; one process and one window drive them all
+hosts=[None]+logins
+host_filter=''
 
 #for arg in vars(args):
 #    print(getattr(args,arg))
 
 #output=subprocess.run(['ssh','daniel@10.0.0.188','lsblk'])
 
-scan()
+if args.batch:
+    scan()
+    startup_mark('discovery and SMART data')
+    if args.startup_timing:
+        print_startup_timing()
+    self_test_monitor=SelfTestMonitor(lambda test: None)
+    ok=run_batch(batch_policy,args.jobs,args.progress_interval)
+    self_test_monitor.stop()
+    #the SMART snapshots taken as the last jobs ended
+    smart_loader.shutdown(wait=True)
+    close_transports()
+    journal.close()
+    print(metrics_line())
+    print_profile()
+    raise SystemExit(0 if ok else 1)
 
 tabgroup = sg.TabGroup(
-    [[main_tab()],[new_tab(serial) for serial in smart_data_dict.keys()]],
+    [[main_tab()]],
     key='Tabgroup',
     enable_events = True
 )
@@ -577,6 +3835,10 @@ layout = [
                 sg.Button('Short Test',key="-Short-"),
                 sg.Button('Long Test',key="-Long-"),
                 sg.Button('Erase',key="-Erase-"),
+                sg.Button('Verify',key="-Verify-"),
+                sg.Combo(['full','sampled'],default_value=verify_mode,readonly=True,key="-VerifyMode-"),
+                sg.Button('Surface Scan',key="-Surface-"),
+                sg.Button('Quick Wipe',key="-Quick-"),
                 sg.Button('SMART',key="-SMART-"),
                 sg.Button('HEXDUMP',key="-HEX-"),
                 sg.Button('Refresh',key="-Refresh-"),
@@ -590,71 +3852,197 @@ layout = [
     )],
 ]
 
-window = sg.Window('Shredmeister'+(f' {login}' if login else ' local'), layout, finalize=True)
+window = sg.Window('Shredmeister '+' '.join(str(get_transport(host)) for host in hosts), layout, finalize=True)
+startup_mark('window open')
 
 time_last_polled=0
 window.write_event_value('-RefreshPage-',1)
+#drives appear as each host answers, then their SMART data as each drive answers
+hosts_scanning=len(hosts)
+first_drive_read=False
+startup_done=False
+scan_async(lambda host,result: window.write_event_value('-Discovered-',(host,result)))
 
-#check for subprocess completion (shred, blkdiscard, etc) every x seconds, then send an event to refresh the current tab
-def check_subproc_status():
-    while not QUIT:
-        print("running thread")
-        for item in subproc_list:
-            exitcode=item[1].poll()
-            if exitcode != None:
-                print("process terminated")
-                if exitcode == 0:
-                    all_drives[item[0]].erased=True
-                item[1].terminate()
-                subproc_list.remove(item)
-                window.write_event_value('-RefreshPage-',1)
-        time.sleep(3)
-refresh_thread=threading.Thread(target=check_subproc_status)
-refresh_thread.start()
+#while jobs are running, update the progress display every few seconds
+def progress_tick():
+    if erase_progress or verify_progress or surface_progress:
+        check_slow_drives()
+        erase_scheduler.tick()
+        checkpoint_erases()
+        for serial in list(erase_progress)+list(verify_progress)+list(surface_progress):
+            request_refresh(serial)
+def self_tests_polled():
+    for job in jobs.running('short')+jobs.running('long'):
+        request_refresh(job.serial)
+#every job queued, started or finished redraws its drive
+jobs.subscribe(lambda job,old_state: request_refresh(job.serial))
+#and so does the SMART snapshot taken after each job, which lands a moment later
+smart_history.subscribe(lambda key,event: request_refresh(key))
+#erase, verify, surface scan and quick wipe completion is delivered to the GUI thread as -EraseDone-, -VerifyDone-, -SurfaceDone-
+#and -QuickDone- events
+job_watcher=JobWatcher(progress_tick)
+hotplug_listeners=list()
+if args.hotplug != 'off':
+    for host in hosts:
+        hotplug_source=('udevadm' if host else 'netlink') if args.hotplug == 'auto' else args.hotplug
+        hotplug_listeners.append(HotplugListener(host,hotplug_source,lambda host,result: window.write_event_value('-HotplugAdd-',(host,result)),lambda host,drive_path: window.write_event_value('-HotplugRemove-',(host,drive_path))))
+self_test_monitor=SelfTestMonitor(lambda test: window.write_event_value('-SelfTestDone-',test),self_tests_polled)
 
+#events that take longer than this to handle are reported, as the GUI stutters
+slow_event=0.05
 while not QUIT:
     event,values=window.read()
+    event_start=time.perf_counter()
     if event == sg.WIN_CLOSED:
         QUIT=True
-        refresh_thread.join()
+        job_watcher.stop()
+        self_test_monitor.stop()
+        for hotplug_listener in hotplug_listeners:
+            hotplug_listener.stop()
         break
     elif event == "-Erase-":
         drive=values['Tabgroup']
-        if(drive != None):
-            protocol=smart_data_dict[drive]['device']['protocol']
-            subproc_list.append([drive,erase_drive(str(all_drives[drive].path),protocol)])
-            refresh(drive)
+        if(drive != None and not jobs.active(drive,'erase')):
+            jobs.add(drive,'erase')
+            erase_scheduler.submit(drive,all_drives[drive].host,str(all_drives[drive].path),lambda serial: window.write_event_value('-EraseStart-',serial))
+    elif event == "-EraseStart-":
+        drive=values[event]
+        if not all_drives[drive].removed:
+            proc=start_erase(drive,smart_cache.get(all_drives[drive],float('inf')))
+            job_watcher.watch(proc,lambda exitcode,serial=drive: window.write_event_value('-EraseDone-',(serial,exitcode)))
+        else:
+            erase_scheduler.finished(drive)
+            jobs.transition(drive,'erase','cancelled')
+    elif event == "-Verify-":
+        drive=values['Tabgroup']
+        if(drive != None and not jobs.active(drive,'verify')):
+            progress=verify_progress[drive]=JobProgress(None)
+            job=verify_drive(all_drives[drive].host,str(all_drives[drive].path),progress,values['-VerifyMode-'],all_drives[drive].pattern_seed)
+            jobs.add(drive,'verify','running',job)
+            job_watcher.watch(job,lambda exitcode,serial=drive: window.write_event_value('-VerifyDone-',serial))
+    elif event == "-Surface-":
+        drive=values['Tabgroup']
+        if(drive != None and not jobs.active(drive,'surface')):
+            progress=surface_progress[drive]=JobProgress(None)
+            job=surface_scan_drive(all_drives[drive].host,str(all_drives[drive].path),progress)
+            jobs.add(drive,'surface','running',job)
+            job_watcher.watch(job,lambda exitcode,serial=drive: window.write_event_value('-SurfaceDone-',serial))
+    elif event == "-Quick-":
+        drive=values['Tabgroup']
+        if(drive != None and not jobs.active(drive,'quick')):
+            job=start_quick_wipe(drive)
+            job_watcher.watch(job,lambda exitcode,serial=drive: window.write_event_value('-QuickDone-',serial))
+    #queue a full erase of every drive that was only quick-wiped; the scheduler starts them as their controllers allow
+    elif event == "-EraseQuickWiped-":
+        for key,drive in all_drives.items():
+            if drive.quick_wiped and not drive.erased and not drive.removed and not drive.mounted and not jobs.active(key,'erase') and not jobs.active(key,'quick'):
+                jobs.add(key,'erase')
+                erase_scheduler.submit(key,drive.host,str(drive.path),lambda serial: window.write_event_value('-EraseStart-',serial))
+    elif event == "-Discovered-":
+        host,result=values[event]
+        hosts_scanning-=1
+        apply_discovery(host,*result)
+        request_refresh(values['Tabgroup'])
+    elif event == "-SmartLoaded-":
+        serial=values[event]
+        smart_loading.discard(serial)
+        if not first_drive_read:
+            first_drive_read=True
+            startup_mark('first drive read')
+        request_refresh(serial)
+    #no refresh, which would only queue the read again; the tab just says it failed
+    elif event == "-SmartFailed-":
+        serial=values[event]
+        smart_loading.discard(serial)
+        update_element(f'{serial} model',value='SMART read failed')
+    elif event == "-HotplugAdd-":
+        host,result=values[event]
+        apply_discovery(host,*result,complete=False)
+        request_refresh(values['Tabgroup'])
+    elif event == "-HotplugRemove-":
+        apply_removal(*values[event])
+        request_refresh(values['Tabgroup'])
+    elif event == "-SelfTestDone-":
+        test=values[event]
+        print(f'{test.kind} self-test of {test.serial} finished: {test.result}')
+        if test.kind == 'short':
+            mark_short_tested(test)
+        else:
+            mark_long_tested(test)
+    elif event == "-EraseDone-":
+        finish_erase(*values[event])
+        erase_scheduler.finished(values[event][0])
+    elif event == "-VerifyDone-":
+        serial=values[event]
+        finish_verify(serial,jobs.get(serial,'verify').handle)
+    elif event == "-SurfaceDone-":
+        serial=values[event]
+        finish_surface_scan(serial,jobs.get(serial,'surface').handle)
+    elif event == "-QuickDone-":
+        serial=values[event]
+        finish_quick_wipe(serial,jobs.get(serial,'quick').handle)
     elif event == "-Long-":
         drive=values['Tabgroup']
-        if(drive != None):
-            t=long_test(drive,str(all_drives[drive].path),60*int(smart_data_dict[drive]['ata_smart_data']['self_test']['polling_minutes']['extended'] or 0))
-            timer_list_extended.append((drive,t))
-            window.write_event_value('-RefreshPage-',1)
+        if(drive != None and not jobs.active(drive,'long')):
+            start_self_test_async(drive,'long',60*int(smart_cache.get(all_drives[drive],float('inf'))['ata_smart_data']['self_test']['polling_minutes']['extended'] or 0))
     elif event == "-Short-":
         drive=values['Tabgroup']
-        if(drive != None):
-            t=short_test(drive,str(all_drives[drive].path),60*int(smart_data_dict[drive]['ata_smart_data']['self_test']['polling_minutes']['short'] or 0))
-            timer_list_short.append([drive, t])
-            window.write_event_value('-RefreshPage-',1)
+        if(drive != None and not jobs.active(drive,'short')):
+            start_self_test_async(drive,'short',60*int(smart_cache.get(all_drives[drive],float('inf'))['ata_smart_data']['self_test']['polling_minutes']['short'] or 0))
     elif event == "-SMART-":
         drive=values['Tabgroup']
         if(drive != None):
-            popup_smart_data(str(all_drives[drive].path))
+            popup_smart_data(all_drives[drive].host,str(all_drives[drive].path))
     elif event == "-Refresh-":
-        rescan()
+        print('rescanning drives')
+        hosts_scanning+=len(hosts)
+        scan_async(lambda host,result: window.write_event_value('-Discovered-',(host,result)))
         drive=values['Tabgroup']
+        #explicit refresh always goes to the drive
+        smart_cache.invalidate(drive)
         refresh(drive)
     elif event == "-RefreshPage-":
         drive=values['Tabgroup']
         refresh(drive)
+    elif event == "-RefreshDrives-":
+        #only what is on screen is redrawn; other tabs catch up when they are selected
+        pending=take_refreshes()
+        drive=values['Tabgroup']
+        if drive in pending:
+            refresh(drive,True)
+        elif drive == 'main_tab' and pending:
+            refresh('main_tab')
     elif event == "-HEX-":
         drive=values['Tabgroup']
         if(drive != None):
-            hexdump(str(all_drives[drive].path))
+            hexdump(all_drives[drive].host,str(all_drives[drive].path))
+    elif event == "-HostFilter-":
+        host_filter=values[event]
+        refresh('main_tab')
     elif event == "Tabgroup":
         drive=values['Tabgroup']
         if(drive != None):
             refresh(drive)
+    #startup is over once every host has answered and every drive found has been read
+    if event in ("-Discovered-","-SmartLoaded-","-SmartFailed-") and not startup_done and not hosts_scanning and not smart_loading:
+        startup_done=True
+        startup_mark('every drive read')
+        if args.startup_timing:
+            print_startup_timing()
+    event_time=time.perf_counter()-event_start
+    metrics.observe('gui_event_seconds',event_time,event=event)
+    if event_time > slow_event:
+        print(f'handling {event} took {event_time*1000:.0f} ms')
 
 window.close()
+#erases still running are stopped; save how far they got so they can resume
+stop_erases()
+checkpoint_erases(True)
+journal.close()
+close_transports()
+print(smart_cache)
+print(smart_history)
+print(jobs)
+print(metrics_line())
+print_profile()
 